@@ -23,6 +23,9 @@
 
 import contextlib
 import functools
+import os
+import re
+import time
 import urllib.parse
 
 import msgpack
@@ -47,22 +50,55 @@ def init_app(app):
 
 # this is here to resolve circular imports
 # pylint: disable=wrong-import-position
+import metrics
 from utils import config
 
 SYSTEM_VERSION = 1003  # 10.0.3
 HOST = 'g%08x-lp1.s.n.srv.nintendo.net' % ACNH.GAME_SERVER_ID
 PORT = 443
 
-keys = KeySet(config['keyset-path'])
-prodinfo = ProdInfo(keys, config['prodinfo-path'])
-
-cert = prodinfo.get_ssl_cert()
-pkey = prodinfo.get_ssl_key()
-
-with open(config['ticket-path'], 'rb') as f:
-	ticket = f.read()
-
-backend_settings = Settings('switch.cfg')
+# The console's keys and certificates are loaded when they're first needed rather than on import,
+# so that scripts which only need the database don't pay for them. See warm_up().
+
+@functools.lru_cache(maxsize=None)
+def keys():
+	return KeySet(config['keyset-path'])
+
+@functools.lru_cache(maxsize=None)
+def ssl_credentials():
+	"""Return the console's SSL certificate and private key."""
+	prodinfo = ProdInfo(keys(), config['prodinfo-path'])
+	return prodinfo.get_ssl_cert(), prodinfo.get_ssl_key()
+
+@functools.lru_cache(maxsize=None)
+def ticket():
+	with open(config['ticket-path'], 'rb') as f:
+		return f.read()
+
+@functools.lru_cache(maxsize=None)
+def backend_settings():
+	return Settings('switch.cfg')
+
+def warm_up():
+	"""Load everything that would otherwise be loaded on first use."""
+	keys()
+	ssl_credentials()
+	ticket()
+	backend_settings()
+
+ACNH_REQUEST_SECONDS = metrics.histogram(
+	'acplaza_acnh_request_seconds', 'Time taken by requests to the ACNH API.', labels=['method', 'path', 'status'],
+)
+TOKEN_REFRESH_SECONDS = metrics.histogram(
+	'acplaza_token_refresh_seconds', 'Time taken to fetch a new token from Nintendo.', labels=['token'],
+)
+
+# path segments which are (or contain) IDs, apart from API versions
+ID_SEGMENT = re.compile('/(?!v[0-9]+(?:/|$))[^/]*[0-9][^/]*')
+
+def path_template(url):
+	"""Return the path of url with any IDs replaced by :id, so that requests can be grouped by endpoint."""
+	return ID_SEGMENT.sub('/:id', urllib.parse.urlparse(url).path)
 
 class ACNHClient:
 	BASE = 'https://api.hac.lp1.acbaa.srv.nintendo.net'
@@ -92,7 +128,16 @@ class ACNHClient:
 		if not path.startswith(self.BASE):
 			path = self.BASE + path
 
-		return self.session.request(method, path, headers=headers, **kwargs)
+		start = time.perf_counter()
+		status = 'error'
+		try:
+			resp = self.session.request(method, path, headers=headers, **kwargs)
+			status = resp.status_code
+			return resp
+		finally:
+			ACNH_REQUEST_SECONDS.observe(
+				time.perf_counter() - start, method=method, path=path_template(path), status=status,
+			)
 
 	def __enter__(self):
 		return self.session.__enter__()
@@ -125,8 +170,8 @@ def gfunc(func):
 
 @gfunc
 def dauth():
-	dauth = DAuthClient(keys)
-	dauth.set_certificate(cert, pkey)
+	dauth = DAuthClient(keys())
+	dauth.set_certificate(*ssl_credentials())
 	dauth.set_system_version(SYSTEM_VERSION)
 	return dauth
 
@@ -143,21 +188,51 @@ def baas():
 	baas.authenticate(device_token())
 	return baas
 
+def shards():
+	"""Return the shard number of every account that designs can be uploaded to.
+	Shard 0 is the account configured at the top level of config.toml, and the rest are uploader-accounts.
+	"""
+	return range(1 + len(config.get('uploader-accounts', ())))
+
+def account(shard=0):
+	"""Return the config of the account for the given shard."""
+	return config if shard == 0 else config['uploader-accounts'][shard - 1]
+
+def shard_path(path, shard):
+	"""Return where to cache a per account token for the given shard."""
+	if shard == 0:
+		return path
+	base, ext = os.path.splitext(path)
+	return f'{base}-{shard}{ext}'
+
+class ShardClients(dict):
+	"""ACNH clients for each account, keyed by shard. They're logged in to as they're needed."""
+	def __missing__(self, shard):
+		_, id_token = baas_credentials(shard)
+		acnh = ACNHClient(id_token)
+		acnh_token_ = acnh_token(acnh, shard)
+		try:
+			self[shard] = rv = ACNHClient(acnh_token_)
+		finally:
+			acnh.close()
+		return rv
+
+	def close(self):
+		for client in self.values():
+			client.close()
+
 @gfunc
-def acnh():
-	_, id_token = baas_credentials()
-	acnh = ACNHClient(id_token)
-	acnh_token_ = acnh_token(acnh)
-	try:
-		return ACNHClient(acnh_token_)
-	finally:
-		acnh.close()
+def acnh_clients():
+	return ShardClients()
+
+def acnh(shard=0):
+	return acnh_clients()[shard]
 
 def backend():
 	with contextlib.suppress(AttributeError):
 		return request.backend
 
-	backend = BackEndClient(backend_settings)
+	backend = BackEndClient(backend_settings())
 	backend.configure(ACNH.ACCESS_KEY, ACNH.NEX_VERSION, ACNH.CLIENT_VERSION)
 
 	# connect to game server
@@ -179,35 +254,53 @@ def close_backend(response):
 		request.backend.close()
 	return response
 
+def timed_refresh(token, get_token):
+	"""Wrap get_token, which fetches a new token to be cached by load_cached, so that it's timed."""
+	def refresh():
+		with TOKEN_REFRESH_SECONDS.time(token=token):
+			return get_token()
+	return refresh
+
 def device_token():
-	return load_cached('tokens/dauth-token.txt', lambda: dauth().device_token()['device_auth_token'])
+	return load_cached(
+		'tokens/dauth-token.txt',
+		timed_refresh('dauth', lambda: dauth().device_token()['device_auth_token']),
+	)
 
 def aauth_token():
-	return load_cached('tokens/aauth-token.txt', lambda: aauth().auth_digital(
+	return load_cached('tokens/aauth-token.txt', timed_refresh('aauth', lambda: aauth().auth_digital(
 		ACNH.TITLE_ID, ACNH.TITLE_VERSION,
-		device_token(), ticket
-	)['application_auth_token'])
+		device_token(), ticket()
+	)['application_auth_token']))
+
+def baas_credentials(shard=0):
+	account_ = account(shard)
 
-def baas_credentials():
 	def get_credentials():
-		resp = baas().login(config['baas-user-id'], config['baas-password'], aauth_token())
+		resp = baas().login(account_['baas-user-id'], account_['baas-password'], aauth_token())
 		return toml.dumps({'user-id': int(resp['user']['id'], base=16), 'id-token': resp['idToken']})
 
-	resp = toml.loads(load_cached('tokens/baas-credentials.txt', get_credentials, duration=2.5 * 60 * 60))
+	resp = toml.loads(load_cached(
+		shard_path('tokens/baas-credentials.txt', shard),
+		timed_refresh('baas', get_credentials),
+		duration=2.5 * 60 * 60,
+	))
 	return resp['user-id'], resp['id-token']
 
-def acnh_token(acnh):
+def acnh_token(acnh, shard=0):
+	account_ = account(shard)
+
 	def get_acnh_token():
 		resp = acnh.request('POST', '/api/v1/auth_token', data=msgpack.dumps({
-			'id': config['acnh-user-id'],
-			'password': config['acnh-password'],
+			'id': account_['acnh-user-id'],
+			'password': account_['acnh-password'],
 		}))
 		resp.raise_for_status()
 		return resp.content
 
 	resp = msgpack.loads(load_cached(
-		'tokens/acnh-token.msgpack',
-		get_acnh_token,
+		shard_path('tokens/acnh-token.msgpack', shard),
+		timed_refresh('acnh', get_acnh_token),
 		duration=5 * 60 * 60,
 		binary=True,
 	))
@@ -1,17 +1,18 @@
 # © 2020 io mintz <io@mintz.cc>
 
+import concurrent.futures
 import contextlib
-import operator
+import time
 import urllib.parse
 from http import HTTPStatus
 from functools import wraps
-from typing import Union
+from typing import Dict, Optional, Union
 
 import msgpack
+import requests
 
-from utils import config
 from .. import utils
-from ..common import acnh
+from ..common import account, acnh
 from ..errors import (
 	UnknownDesignCodeError,
 	InvalidDesignCodeError,
@@ -86,10 +87,13 @@ def download_design(design_id, partial=False):
 	merge_headers(data, headers)
 	return data
 
-def list_designs(author_id: int, *, pro: bool, with_binaries: bool = False):
+# the most designs Nintendo will list at once, which is also the number of slots each account has
+MAX_PAGE_SIZE = 120
+
+def list_designs(author_id: int, *, pro: bool, with_binaries: bool = False, offset=0, limit=MAX_PAGE_SIZE):
 	resp = acnh().request('GET', '/api/v2/designs', params={
-		'offset': 0,
-		'limit': 120,
+		'offset': offset,
+		'limit': limit,
 		'q[player_id]': author_id,
 		'q[pro]': 'true' if pro else 'false',
 		'with_binaries': 'true' if with_binaries else 'false',
@@ -98,27 +102,76 @@ def list_designs(author_id: int, *, pro: bool, with_binaries: bool = False):
 	resp = msgpack.loads(resp.content)
 	return resp
 
-def stale_designs(needed, *, pro: bool):
-	r = list_designs(config['acnh-design-creator-id'], pro=pro)
-	free_slots = MAX_DESIGNS - r['count']
-	if free_slots >= needed:
-		return []
-	return sorted(r['headers'], key=operator.itemgetter('created_at'))[:needed]
+def creator_designs(*, pro: bool, shard=0):
+	"""List every design in one of our own creator accounts. Only used to reconcile the local slot ledger."""
+	return list_designs(account(shard)['acnh-design-creator-id'], pro=pro)['headers']
 
 @accepts_design_id
-def delete_design(design_id) -> None:
-	resp = acnh().request('DELETE', f'/api/v1/designs/{design_id}')
+def delete_design(design_id, *, shard=0) -> None:
+	_delete_design(acnh(shard), design_id)
+
+def _delete_design(client, design_id):
+	resp = client.request('DELETE', f'/api/v1/designs/{design_id}')
 	if resp.status_code == HTTPStatus.NOT_FOUND:
 		raise UnknownDesignCodeError
+	resp.raise_for_status()
+
+# failures which are worth retrying
+TRANSIENT_STATUSES = frozenset({
+	HTTPStatus.TOO_MANY_REQUESTS,
+	HTTPStatus.INTERNAL_SERVER_ERROR,
+	HTTPStatus.BAD_GATEWAY,
+	HTTPStatus.SERVICE_UNAVAILABLE,
+	HTTPStatus.GATEWAY_TIMEOUT,
+})
+DELETE_CONCURRENCY = 8
+DELETE_RETRIES = 3
+# seconds before the first retry. Doubles after each subsequent attempt.
+RETRY_DELAY = 0.5
+
+def delete_designs(
+	design_ids, *, shard=0, concurrency=DELETE_CONCURRENCY, retries=DELETE_RETRIES,
+) -> Dict[int, Optional[Exception]]:
+	"""Delete several designs belonging to the account for shard, at most concurrency at a time.
+	Designs that don't exist count as deleted, and transient failures are retried up to retries times.
+	Returns a dict mapping each design ID to None if it was deleted, or to the exception that prevented that.
+	"""
+	client = acnh(shard)
+
+	def delete(design_id):
+		for attempt in range(retries + 1):
+			if attempt:
+				time.sleep(RETRY_DELAY * 2 ** (attempt - 1))
+
+			try:
+				_delete_design(client, design_id)
+			except UnknownDesignCodeError:
+				return None
+			except requests.HTTPError as exc:
+				if exc.response.status_code not in TRANSIENT_STATUSES:
+					return exc
+				error = exc
+			except (requests.ConnectionError, requests.Timeout) as exc:
+				error = exc
+			else:
+				return None
+
+		return error
+
+	if not design_ids:
+		return {}
+
+	with concurrent.futures.ThreadPoolExecutor(max_workers=min(concurrency, len(design_ids))) as pool:
+		return dict(zip(design_ids, pool.map(delete, design_ids)))
 
 design_errors = {
 	HTTPStatus.BAD_REQUEST: InvalidDesignError,
 	HTTPStatus.INTERNAL_SERVER_ERROR: DesignLitTheServerOnFireError,
 }
 
-def create_design(design_data) -> int:
-	"""create a design. returns the created design ID."""
-	resp = acnh().request('POST', '/api/v1/designs', data=msgpack.dumps(design_data))
+def create_design(design_data, *, shard=0) -> int:
+	"""create a design in the account for shard. returns the created design ID."""
+	resp = acnh(shard).request('POST', '/api/v1/designs', data=msgpack.dumps(design_data))
 	with contextlib.suppress(KeyError):
 		raise design_errors[resp.status_code]
 	resp.raise_for_status()
@@ -1,19 +1,37 @@
 # © 2020 io mintz <io@mintz.cc>
 
+import concurrent.futures
+import contextlib
+import datetime as dt
 import enum
+import json
+import multiprocessing
 import random
 import time
+import traceback
 from dataclasses import dataclass, field
 from functools import partial
 from typing import List, Generic, TypeVar, Optional
 
 import wand.image
-from flask import request
+from flask import current_app, request
 
-from . import api, encode
+from . import api, encode, eviction, preview
 from .format import SIZE, MAX_DESIGN_TILES
-from utils import pg, queries
-from ..errors import UnknownImageIdError, DeletionDeniedError, TiledImageTooBigError, ImageNameTooLongError, num_tiles
+import archive_cache
+import metrics
+import page_cache
+from utils import config, pg, python_executable, queries
+from ..common import account, shards
+from ..errors import (
+	ACNHError,
+	ImageJobFailedError,
+	UnknownImageJobIdError,
+	UnknownImageIdError,
+	DeletionDeniedError,
+	TiledImageTooBigError,
+	ImageNameTooLongError,
+)
 
 ISLAND_NAMES = [
 	'The Cloud',
@@ -53,19 +71,78 @@ class PageSpecifier(Generic[T]):
 	def before(cls, reference: T) -> 'PageSpecifier[T]':
 		return cls(PageDirection.before, reference)
 
-def garbage_collect_designs(needed_slots: int, *, pro: bool):
-	"""Free at least needed_slots. Pass pro depending on whether Pro slots are needed."""
-	design_ids = [hdr['id'] for hdr in api.stale_designs(needed_slots, pro=pro)]
-	if not design_ids:
-		return
-
-	print('GC', len(design_ids), 'designs')
-	for design_id in design_ids:
-		api.delete_design(design_id)
-
-	tag = pg().execute(queries.delete_designs(), design_ids)
-	if tag != f'DELETE {len(design_ids)}':
-		print('One or more stale design IDs were found in the API but not in the database! Ignoring…')
+EVICTIONS = metrics.counter(
+	'acplaza_evicted_designs_total', 'Designs deleted to make room for new ones.', labels=['pro'],
+)
+
+def garbage_collect_designs(needed_slots: int, *, pro: bool, shard=0):
+	"""Free at least needed_slots in the account for shard. Pass pro depending on whether Pro slots are needed.
+
+	Slots are counted from the designs table rather than by listing the creator account,
+	so this makes no upstream requests unless something actually has to be evicted.
+	Which designs are evicted is decided by the configured eviction policy (see eviction.py).
+	"""
+	with pg().transaction():
+		free_slots = api.MAX_DESIGNS - pg().fetchval(queries.design_slots_used(), pro, shard)
+		if free_slots >= needed_slots:
+			return
+
+		# SKIP LOCKED so that concurrent uploads don't both try to evict the same designs
+		design_ids = pg().fetchvals(
+			queries.eviction_candidates(policy=eviction.policy()), pro, shard, needed_slots - free_slots,
+		)
+		if not design_ids:
+			return
+
+		print('GC', len(design_ids), 'designs from shard', shard)
+		# designs that couldn't be deleted keep their rows, since they still take up slots
+		evicted = deleted_designs(api.delete_designs(design_ids, shard=shard))
+		delete_design_rows(evicted)
+		EVICTIONS.inc(len(evicted), pro=pro)
+
+# how old an upstream design with no designs row must be before we consider it abandoned
+# (as opposed to one whose row is about to be inserted by an upload in progress)
+ORPHAN_GRACE_PERIOD = 10 * 60
+
+def reconcile_designs(*, pro: bool, shard=0):
+	"""Correct drift between the designs table and the designs that actually exist in the creator account for shard.
+
+	Rows for designs which no longer exist upstream are deleted, and upstream designs which have no row
+	(e.g. because the request that uploaded them died before recording them) are deleted upstream,
+	since they take up slots that garbage_collect_designs doesn't know about.
+	Returns a tuple of (forgotten design IDs, orphaned design IDs).
+	"""
+	# fetch these first so that a design uploaded while we're listing can't be mistaken for a forgotten one
+	local = set(pg().fetchvals(queries.pool_design_ids(), pro, shard))
+	upstream = {hdr['id']: hdr for hdr in api.creator_designs(pro=pro, shard=shard)}
+
+	forgotten = list(local - upstream.keys())
+	if forgotten:
+		delete_design_rows(forgotten)
+
+	cutoff = time.time() - ORPHAN_GRACE_PERIOD
+	orphaned = [
+		design_id
+		for design_id, hdr in upstream.items()
+		if design_id not in local and hdr['created_at'] < cutoff
+	]
+	orphaned = deleted_designs(api.delete_designs(orphaned, shard=shard))
+
+	return forgotten, orphaned
+
+def delete_design_rows(design_ids):
+	"""Forget design_ids, along with the cached pages that show them."""
+	image_ids = set(pg().fetchvals(queries.delete_designs(), design_ids))
+	page_cache.forget_designs(design_ids)
+	for image_id in image_ids:
+		page_cache.forget_image(image_id)
+
+def deleted_designs(results) -> List[int]:
+	"""Given the results of api.delete_designs, report the failures and return the IDs that were deleted."""
+	for design_id, error in results.items():
+		if error is not None:
+			print('Failed to delete design', design_id, repr(error))
+	return [design_id for design_id, error in results.items() if error is None]
 
 def delete_image(image_id):
 	image_author_id = pg().fetchval(queries.image_author_id(), image_id)
@@ -76,11 +153,51 @@ def delete_image(image_id):
 		raise DeletionDeniedError
 
 	with pg().transaction(isolation='serializable'):
-		design_ids = pg().fetchvals(queries.delete_image_designs(), image_id)
+		rows = pg().fetch(queries.delete_image_designs(), image_id)
 		pg().execute(queries.delete_image(), image_id)
+		# designs can be shared by identical images, so only delete the ones that nothing else uses
+		design_ids = pg().fetchvals(queries.unreferenced_designs(), [row['design_id'] for row in rows])
+		pg().execute(queries.forget_design_accesses(), design_ids)
+
+	page_cache.forget_image(image_id)
+	page_cache.forget_designs(row['design_id'] for row in rows)
+	archive_cache.forget(image_id)
+
+	by_shard = {}
+	for row in rows:
+		if row['design_id'] in design_ids:
+			by_shard.setdefault(row['shard'], set()).add(row['design_id'])
+
+	# the image is already gone as far as the user is concerned, so don't make them wait on upstream
+	for shard, shard_design_ids in by_shard.items():
+		delete_designs_later(list(shard_design_ids), shard=shard)
+
+_background_pool = None
+
+def background_pool() -> concurrent.futures.ThreadPoolExecutor:
+	"""Return the thread pool used for work that shouldn't hold up the request that caused it."""
+	global _background_pool  # pylint: disable=global-statement
+	if _background_pool is None:
+		_background_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+	return _background_pool
+
+def delete_designs_later(design_ids, *, shard=0):
+	"""Delete design_ids from the account for shard in the background.
+	Must be called after the rows referencing them are gone. Under uWSGI this needs enable-threads = true.
+	"""
+	if not design_ids:
+		return
+
+	app = current_app._get_current_object()  # pylint: disable=protected-access
 
-	for design_id in design_ids:
-		api.delete_design(design_id)
+	def delete():
+		try:
+			with app.app_context():
+				deleted_designs(api.delete_designs(design_ids, shard=shard))
+		except Exception:  # pylint: disable=broad-except
+			traceback.print_exc()
+
+	background_pool().submit(delete)
 
 def create_image(design, **kwargs):
 	return (create_pro_design if design.pro else create_basic_design)(design, **kwargs)
@@ -88,7 +205,11 @@ def create_image(design, **kwargs):
 def create_pro_design(design):
 	"""Upload a pro design. Returns an iterable for consistency with create_basic_design."""
 	was_quantized, encoded = encode.encode(design)
-	garbage_collect_designs(1, pro=True)
+	image_id = insert_pro_image(design)
+	yield image_id
+	yield from upload_pro_design(image_id, design, (was_quantized, encoded))
+
+def insert_pro_image(design):
 	image_id = pg().fetchval(
 		queries.create_image(),
 
@@ -101,15 +222,29 @@ def create_pro_design(design):
 		design.type_code,
 		[bytearray(image.export_pixels()) for image in design.layer_images.values()],
 	)
-	design_id = api.create_design(encoded)
-	create_design(image_id=image_id, design_id=design_id, position=1, pro=True)
+	log_image_access(image_id)
+	return image_id
+
+def upload_pro_design(image_id, design, result=None):
+	"""Upload the design of an already created pro image. result is the return value of encode.encode(design),
+	if it's already known.
+	"""
+	was_quantized, encoded = result or encode.encode(design)
+	save_payload(image_id, 1, was_quantized, encoded)
+	yield from upload_designs(image_id, [(1, was_quantized, encoded)], 1, pro=True)
+	save_previews(image_id, design, scale=True)
+
+def create_basic_design(design, *, scale: bool, quantize_whole=False):
+	"""Upload a basic design. Scale controls whether to tile or scale the image. Returns an iterable of design IDs.
+	If quantize_whole is true, tiles are quantized against a palette generated from the whole image.
+	"""
+	image_id = insert_basic_image(design, scale=scale)
 	yield image_id
-	yield was_quantized, design_id
+	yield from upload_basic_design(image_id, design, scale=scale, quantize_whole=quantize_whole)
 
-def create_basic_design(design, *, scale: bool):
-	"""Upload a basic design. Scale controls whether to tile or scale the image. Returns an iterable of design IDs."""
+def insert_basic_image(design, *, scale: bool):
 	image = design.layer_images['0']
-	images = split_images(design, scale=scale)
+	validate_basic(design, scale=scale)
 
 	# XXX is it a Design class or an Image class. It's both! Is that OK?
 	image_id = pg().fetchval(
@@ -124,53 +259,327 @@ def create_basic_design(design, *, scale: bool):
 		design.type_code,
 		[bytearray(image.export_pixels())],
 	)
-	yield image_id
+	log_image_access(image_id)
+	return image_id
+
+def upload_basic_design(image_id, design, *, scale: bool, quantize_whole=False):
+	"""Upload the designs of an already created basic image."""
+	images = split_images(design, scale=scale)
+	if quantize_whole and len(images) > 1:
+		tiles = encode.quantize_tiles(images)
+	else:
+		tiles = [(bytes(image.export_pixels()), image.size, False) for image in images]
 	# backwards so that the first image shows up first in game
-	images = list(zip(reversed(range(1, len(images) + 1)), reversed(images)))
-	yield from create_designs(image_id, design, images, tile=not scale)
-
-def create_designs(image_id, design, images, *, tile: bool):
-	garbage_collect_designs(len(images), pro=False)
-	for count, (i, image) in enumerate(images, 1):
-		design_name = f'{design.design_name} {i}' if tile else design.design_name
-		sub_design = encode.BasicDesign(
-			design_name=design_name,
+	positions = list(zip(reversed(range(1, len(tiles) + 1)), reversed(tiles)))
+	yield from create_designs(image_id, design, positions, tile=not scale)
+	# single designs are small enough that they're shown scaled up
+	save_previews(image_id, design, scale=len(images) == 1)
+
+def enqueue_image(design, *, scale=False, quantize_whole=False):
+	"""Create an image, but instead of uploading its designs now, queue a job for image_worker.py to do so.
+	Returns a tuple of (image_id, job_id).
+	"""
+	options = {}
+	with pg().transaction():
+		if design.pro:
+			# the rest of the validation happens when the design is encoded
+			design.validate()
+			image_id = insert_pro_image(design)
+		else:
+			image_id = insert_basic_image(design, scale=scale)
+			options['quantize_whole'] = quantize_whole
+		job_id = pg().fetchval(queries.enqueue_image_job(), image_id, json.dumps(options))
+
+	return image_id, job_id
+
+# how long a job can be running for before we assume its worker died and let another worker take it
+IMAGE_JOB_TIMEOUT = dt.timedelta(minutes=10)
+
+def claim_image_job():
+	"""Take the oldest queued image job, marking it as running. Returns None if there are no jobs to run."""
+	return pg().fetchrow(queries.claim_image_job(), IMAGE_JOB_TIMEOUT)
+
+def run_image_job(job):
+	"""Upload the designs for a job returned by claim_image_job, recording whether it succeeded."""
+	image_id = job['image_id']
+	try:
+		if job['attempts'] > 1:
+			# a previous attempt may have uploaded some of the designs already
+			for _ in refresh_image(image_id, **json.loads(job['options'])):
+				pass
+			image_previews(image_id)
+		else:
+			image_info = pg().fetchrow(queries.image(), image_id)
+			design = image_design(
+				image_info,
+				island_name=island_name(),
+				author_name=image_info['author_name'],
+				design_name=image_info['image_name'],
+			)
+			with contextlib.ExitStack() as stack:
+				for img in design.layer_images.values():
+					stack.enter_context(img)
+
+				if image_info['pro']:
+					results = upload_pro_design(image_id, design)
+				else:
+					results = upload_basic_design(
+						image_id,
+						design,
+						scale=image_info['mode'] == 'scale',
+						**json.loads(job['options']),
+					)
+				for _ in results:
+					pass
+	except ACNHError as ex:
+		pg().execute(queries.fail_image_job(), job['job_id'], json.dumps(ex.to_dict()))
+	except Exception:
+		pg().execute(queries.fail_image_job(), job['job_id'], json.dumps(ImageJobFailedError().to_dict()))
+		raise
+	else:
+		pg().execute(queries.finish_image_job(), job['job_id'])
+
+def image_job(job_id):
+	job = pg().fetchrow(queries.image_job(), job_id)
+	if job is None:
+		raise UnknownImageJobIdError
+	job = dict(job)
+	if job['error'] is not None:
+		job['error'] = json.loads(job['error'])
+	return job
+
+def image_job_results(image_id, *, after=()):
+	"""Return (was_quantized, design_id) for every design that an image job has uploaded so far,
+	excluding the design IDs in after.
+	"""
+	return [
+		(row['was_quantized'], row['design_id'])
+		for row
+		in pg().fetch(queries.image_job_results(), image_id)
+		if row['design_id'] not in after
+	]
+
+_encode_pool = None
+# every uWSGI worker gets its own pool, so keep them small
+DEFAULT_ENCODE_PROCESSES = 2
+
+def encode_pool() -> concurrent.futures.ProcessPoolExecutor:
+	"""Return the process pool used to encode the tiles of basic images, and render the layers of archives,
+	in parallel.
+	"""
+	global _encode_pool  # pylint: disable=global-statement
+	if _encode_pool is None:
+		# Not fork, since by now this process has used ImageMagick, whose OpenMP thread pool doesn't survive fork().
+		# The forkserver is a fresh interpreter, so it has to be told which one, as under uWSGI sys.executable is uwsgi.
+		context = multiprocessing.get_context('forkserver')
+		context.set_executable(python_executable())
+		_encode_pool = concurrent.futures.ProcessPoolExecutor(
+			max_workers=config.get('encode-processes', DEFAULT_ENCODE_PROCESSES),
+			mp_context=context,
+		)
+	return _encode_pool
+
+def create_designs(image_id, design, tiles, *, tile: bool):
+	"""Encode and upload tiles, an iterable of (position, (pixels, size, was_quantized)) tuples."""
+	# encode every tile up front so that none of the encoding happens in between uploads
+	futures = [
+		(position, encode_pool().submit(
+			encode.encode_basic_pixels,
+			pixels,
+			size,
+			quantized=was_quantized,
+			design_name=sub_design_name(design, position, tile=tile),
 			island_name=design.island_name,
 			author_name=design.author_name,
-			layers={'0': image},
-		)
+		))
+		for position, (pixels, size, was_quantized)
+		in tiles
+	]
+
+	def payloads():
+		try:
+			for position, future in futures:
+				was_quantized, encoded = future.result()
+				save_payload(image_id, position, was_quantized, encoded)
+				yield position, was_quantized, encoded
+		finally:
+			for _, future in futures:
+				future.cancel()
+
+	yield from upload_designs(image_id, payloads(), len(futures), pro=False)
+
+def sub_design_name(design, position, *, tile: bool):
+	return f'{design.design_name} {position}' if tile else design.design_name
+
+def sub_design(design, image, position, *, tile: bool):
+	"""Return the BasicDesign for one tile (or the only design, if scaling) of a basic image."""
+	return encode.BasicDesign(
+		design_name=sub_design_name(design, position, tile=tile),
+		island_name=design.island_name,
+		author_name=design.author_name,
+		layers={'0': image},
+	)
+
+# designs get out of order in game if we post them too fast.
+# This is the minimum time between the *start* of consecutive uploads, so any time spent waiting on the API counts.
+MIN_UPLOAD_INTERVAL = 0.5
+
+def upload_designs(image_id, payloads, count, *, pro: bool):
+	"""Upload count already encoded designs, given as an iterable of (position, was_quantized, encoded) tuples.
+	Yields (was_quantized, design_id) as each one is created.
+	"""
+	try:
+		yield from _upload_designs(image_id, payloads, count, pro=pro)
+	finally:
+		# pages rendered while the designs were being uploaded aren't cached, but ones rendered before might be
+		page_cache.forget_image(image_id)
+
+def _upload_designs(image_id, payloads, count, *, pro: bool):
+	shard = place_image(image_id, pro=pro)
+	last_upload = None
+	for done, (position, was_quantized, encoded) in enumerate(payloads):
+		if shard:
+			# payloads are always encoded for the first account
+			encoded = encode.for_profile(encoded, account(shard)['baas-profile-id'])
+		digest = encode.content_digest(encoded['body'])
+		design_id = reuse_design(image_id=image_id, position=position, pro=pro, digest=digest, shard=shard)
+		if design_id is not None:
+			yield was_quantized, design_id
+			continue
+
 		# we do this on each loop in case someone uploaded a few more designs in between iterations
-		garbage_collect_designs(len(images) - (count - 1), pro=False)
-		# designs get out of order if we post them too fast
-		time.sleep(0.5)
-		was_quantized, encoded = encode.encode(sub_design)
-		design_id = api.create_design(encoded)
-		create_design(image_id=image_id, design_id=design_id, position=i, pro=False)
+		garbage_collect_designs(count - done, pro=pro, shard=shard)
+		if last_upload is not None:
+			time.sleep(max(0, MIN_UPLOAD_INTERVAL - (time.monotonic() - last_upload)))
+		last_upload = time.monotonic()
+		design_id = api.create_design(encoded, shard=shard)
+		create_design(
+			image_id=image_id, design_id=design_id, position=position, pro=pro, digest=digest, shard=shard,
+		)
 		yield was_quantized, design_id
 
-def split_images(design: encode.BasicDesign, *, scale: bool):
+def place_image(image_id, *, pro: bool) -> int:
+	"""Choose which account to upload the designs of image_id to, and return its shard.
+	All the designs of an image are kept in one account, which is recorded on the image the first time
+	its designs are uploaded, so refreshes stay there even once every design has been evicted.
+	Otherwise the account with the most free slots is chosen. Every account has the same number of slots,
+	so if that one can't fit all the designs without evicting some, no other account could either.
+	"""
+	shard = pg().fetchval(queries.image_shard(), image_id)
+	if shard is None:
+		used = dict(pg().fetch(queries.design_slots_used_by_shard(), pro))
+		shard = min(shards(), key=lambda shard: (used.get(shard, 0), shard))
+	return pg().fetchval(queries.set_image_shard(), image_id, shard)
+
+def reuse_design(*, image_id, position, pro, digest, shard=0):
+	"""If a live design has the same content as the one we're about to upload, use it for this position as well.
+	Returns the reused design ID, or None if there's nothing to reuse.
+	"""
+	with pg().transaction():
+		# this locks the existing design so that it can't be garbage collected out from under us
+		design_id = pg().fetchval(queries.live_design_by_digest(), digest, pro, shard)
+		if design_id is not None:
+			create_design(
+				image_id=image_id, design_id=design_id, position=position, pro=pro, digest=digest, shard=shard,
+			)
+	return design_id
+
+def encode_payload(image_id, position, design):
+	"""Encode a design and store the result so that it never has to be encoded again."""
+	was_quantized, encoded = encode.encode(design)
+	save_payload(image_id, position, was_quantized, encoded)
+	return was_quantized, encoded
+
+def encode_tile_payload(image_id, position, design, tile):
+	"""Like encode_payload, but for a tile already quantized by encode.quantize_tiles."""
+	pixels, size, was_quantized = tile
+	was_quantized, encoded = encode.encode_basic_pixels(
+		pixels,
+		size,
+		quantized=was_quantized,
+		design_name=design.design_name,
+		island_name=design.island_name,
+		author_name=design.author_name,
+	)
+	save_payload(image_id, position, was_quantized, encoded)
+	return was_quantized, encoded
+
+def save_payload(image_id, position, was_quantized, encoded):
+	pg().execute(
+		queries.save_design_payload(),
+		image_id, position, encode.FORMAT_VERSION, was_quantized,
+		encoded['meta'], encoded['body'], encoded['net_image'],
+	)
+
+def stored_payload(row):
+	"""Convert a design_payloads row back into the (was_quantized, encoded) format that encode.encode returns."""
+	return row['was_quantized'], {
+		'meta': row['meta'],
+		'body': row['body'],
+		'net_image': row['net_image'],
+		'preview_image': encode.dummy_preview_image(),
+	}
+
+def validate_basic(design: encode.BasicDesign, *, scale: bool):
 	image = design.layer_images['0']
 	if image.size > SIZE and not scale:
 		TiledImageTooBigError.validate(image)
 		ImageNameTooLongError.validate(design)
+
+def split_images(design: encode.BasicDesign, *, scale: bool):
+	image = design.layer_images['0']
+	if image.size > SIZE and not scale:
+		validate_basic(design, scale=scale)
 		return list(encode.tile(image))
 
 	# scale if necessary
 	return [image.clone()]
 
-def refresh_image(image_id):
-	rows = pg().fetch(queries.image_with_designs(), image_id)
+def refresh_image(image_id, *, quantize_whole=False):
+	"""Re-upload any designs of an image which were garbage collected.
+
+	Designs are re-uploaded from their stored payloads where possible; the image layers are only fetched
+	and encoded again for positions whose payload is missing or was stored by an older version of encode.encode.
+	Pass quantize_whole if the image was first uploaded with it, so that those are quantized the same way.
+	"""
+	rows = pg().fetch(queries.image_with_designs(layers=False), image_id)
 	if not rows:
 		raise UnknownImageIdError
 	image_info = rows[0]
-	required_design_count = 1 if image_info['pro'] else num_tiles(image_info['width'], image_info['height'])
-	if len(rows) == required_design_count:
-		return None
+	design_positions = {row['position'] for row in rows if row['design_id'] is not None}
+	# scaled images are stored at their original size, but still only have one design
+	missing_positions = set(range(1, image_info['designs_required'] + 1)) - design_positions
+	if not missing_positions:
+		return
 
-	if image_info['pro']:
-		yield from refresh_pro_image(image_info)
-	else:
-		yield from refresh_basic_image(rows)
+	stored = {
+		row['position']: row
+		for row
+		in pg().fetch(queries.design_payloads(), image_id, encode.FORMAT_VERSION)
+	}
+	stale_positions = missing_positions - stored.keys()
+	designs = {}
+	shared_tiles = {}
+	if stale_positions:
+		layers = image_layers(image_id)
+		designs = rebuild_designs(dict(image_info, layers=layers))
+		if quantize_whole and len(designs) > 1:
+			# every tile is needed to arrive at the same palette as the designs which are still up
+			positions = sorted(designs)
+			tiles = encode.quantize_tiles([designs[position].layer_images['0'] for position in positions])
+			shared_tiles = dict(zip(positions, tiles))
+
+	def payloads():
+		# backwards so that the first image shows up first in game
+		for position in sorted(missing_positions, reverse=True):
+			if position in shared_tiles:
+				yield (position, *encode_tile_payload(image_id, position, designs[position], shared_tiles[position]))
+			elif position in stale_positions:
+				yield (position, *encode_payload(image_id, position, designs[position]))
+			else:
+				yield (position, *stored_payload(stored[position]))
+
+	yield from upload_designs(image_id, payloads(), len(missing_positions), pro=image_info['pro'])
 
 def gather_layers(cls, layers: List[wand.image.Image]):
 	named_layers = {}
@@ -179,49 +588,80 @@ def gather_layers(cls, layers: List[wand.image.Image]):
 		img.import_pixels(data=blob, channel_map='RGBA')
 	return named_layers
 
-def refresh_pro_image(image_info):
+def image_design(image_info, **kwargs):
+	"""Reconstruct the design for an entire image from its stored layers."""
 	cls = encode.Design(image_info['type_code'])
-	layers = gather_layers(cls, image_info['layers'])
+	if image_info['pro']:
+		layers = gather_layers(cls, image_info['layers'])
+	else:
+		img = wand.image.Image(width=image_info['width'], height=image_info['height'])
+		img.import_pixels(data=image_info['layers'][0], channel_map='RGBA')
+		layers = {'0': img}
 
 	# pylint: disable=not-callable
-	design = cls(layers=layers, island_name=island_name(), design_name=image_info['image_name'])
-	was_quantized, encoded = encode.encode(design)
-	design_id = api.create_design(encoded)
-	create_design(image_id=image_info['image_id'], design_id=design_id, position=0, pro=True)
-	yield was_quantized, design_id
-
-def refresh_basic_image(rows):
-	image_info = rows[0]
-	required_design_count = num_tiles(image_info['width'], image_info['height'])
-
-	design_positions = {row['position'] for row in rows}
-	required_positions = set(range(1, required_design_count + 1))
-	missing_positions = required_positions - design_positions
+	return cls(layers=layers, **kwargs)
+
+def rebuild_designs(image_info):
+	"""Reconstruct the design for each position of an image from its stored layers."""
+	design = image_design(
+		image_info,
+		island_name=island_name(),
+		author_name=image_info['author_name'],
+		design_name=image_info['image_name'],
+	)
+	if image_info['pro']:
+		return {1: design}
+
+	tile = image_info['mode'] == 'tile'
+	images = split_images(design, scale=not tile)
+	return {
+		position: sub_design(design, image, position, tile=tile)
+		for position, image
+		in enumerate(images, 1)
+	}
+
+def save_previews(image_id, design, *, scale: bool):
+	net_image, layers = preview.render(design, scale=scale)
+	pg().execute(queries.save_image_previews(), image_id, net_image, layers)
+	return {'net_image': net_image, 'layers': layers}
+
+def image_previews(image_id):
+	"""Return the stored net image and layer PNGs for an image.
+	Images created before previews were stored have theirs rendered and stored now.
+	"""
+	previews = pg().fetchrow(queries.image_previews(), image_id)
+	if previews is not None:
+		return previews
+
+	image_info = pg().fetchrow(queries.image(), image_id)
+	if image_info is None:
+		raise UnknownImageIdError
 
-	img = wand.image.Image(width=image_info['width'], height=image_info['height'])
-	img.import_pixels(data=image_info['layers'][0], channel_map='RGBA')
-	design = encode.BasicDesign(layers={'0': img}, design_name=image_info['image_name'], island_name=island_name())
-	images = split_images(design, scale=image_info['mode'] == 'scale')
-	to_create = [(i, img) for i, img in enumerate(images, 1) if i in missing_positions]
-	yield from create_designs(image_info['image_id'], design, to_create, tile=image_info['mode'] == 'tile')
+	design = image_design(image_info)
+	try:
+		return save_previews(image_id, design, scale=image_info['designs_required'] == 1)
+	finally:
+		for img in design.layer_images.values():
+			img.close()
 
-def create_design(*, image_id, design_id, position, pro):
-	pg().execute(queries.create_design(), image_id, design_id, position, pro)
+def create_design(*, image_id, design_id, position, pro, digest=None, shard=0):
+	pg().execute(queries.create_design(), image_id, design_id, position, pro, digest, shard)
 
-def image(image_id):
-	rows = pg().fetch(queries.image_with_designs(), image_id)
+def image(image_id, *, layers=True):
+	rows = pg().fetch(queries.image_with_designs(layers=layers), image_id)
 	if not rows:
 		raise UnknownImageIdError
 	image = dict(rows[0])
 	# these are design fields not image fields
-	del image['design_id'], image['position']
+	del image['design_id'], image['position'], image['shard']
 	designs = {}
 	for row in rows:
 		if row['design_id'] is None:
 			break
 		designs[row['position']] = api.design_code(row['design_id'])
 
-	return {'image': image, 'designs': designs}
+	# None if every design was garbage collected
+	return {'image': image, 'designs': designs, 'shard': rows[0]['shard']}
 
 ImageId = int
 
@@ -246,6 +686,31 @@ def images_keyset(page: PageSpecifier[ImageId] = PageSpecifier.first(), *, debug
 		images.reverse()
 	return images
 
+@api.accepts_design_id
+def image_layers(image_id):
+	"""Return the raw RGBA pixels of each layer of an image, without the rest of the image."""
+	return pg().fetchval(queries.image_layers(), image_id)
+
 @api.accepts_design_id
 def design_image(design_id):
+	"""Return the image that design_id belongs to. Doesn't count as an access; the views record those."""
 	return pg().fetchrow(queries.design_image(), design_id)
+
+def record_image_access(image_id):
+	"""Note that image_id was viewed, for the benefit of access aware eviction policies."""
+	pg().execute(queries.record_image_access(), image_id)
+	log_image_access(image_id)
+
+@api.accepts_design_id
+def record_design_access(design_id):
+	"""Note that design_id was viewed. Does nothing if it's not one of ours."""
+	pg().execute(queries.record_design_access(), design_id)
+	if config.get('log-image-accesses'):
+		image_info = pg().fetchrow(queries.design_image(), design_id)
+		if image_info:
+			log_image_access(image_info['image_id'])
+
+def log_image_access(image_id):
+	"""Append image_id to the access log replayed by simulate_eviction.py, if that's enabled."""
+	if config.get('log-image-accesses'):
+		pg().execute(queries.log_image_access(), image_id)
@@ -2,6 +2,8 @@
 
 import contextlib
 import datetime as dt
+import functools
+import hashlib
 import io
 import itertools
 import random
@@ -14,12 +16,19 @@ import wand.color
 import msgpack
 
 from .. import utils
+from . import quantize
 from .format import PALETTE_SIZE, SIZE as STANDARD, WIDTH as STANDARD_WIDTH, HEIGHT as STANDARD_HEIGHT
 from ..errors import InvalidLayerNameError, MissingLayerError, InvalidPaletteError, InvalidLayerSizeError
+import image_arena
+import metrics
 from utils import config
 
 XY = Tuple[int, int]
 
+ENCODE_SECONDS = metrics.histogram('acplaza_encode_seconds', 'Time taken to encode a design for upload.')
+NET_IMAGE_SECONDS = metrics.histogram('acplaza_net_image_seconds', 'Time taken to render the net image of a design.')
+QUANTIZATIONS = metrics.counter('acplaza_quantizations_total', 'Designs which had to be quantized to fit the palette.')
+
 @dataclass
 class LayerCorrespondence:
 	internal_idx: int
@@ -58,7 +67,39 @@ class Layer(metaclass=LayerMeta):
 	def height(self):
 		return self.size[1]
 
-NET_IMAGE_BASE = Layer('', (240, 240)).as_wand()
+# The images below are loaded when they're first needed rather than on import. warm_up() only reads their files,
+# since ImageMagick's OpenMP thread pool doesn't survive fork(), so it mustn't be used before uWSGI forks its workers.
+
+@functools.lru_cache(maxsize=None)
+def net_image_base() -> wand.image.Image:
+	"""Return the blank image which net images are drawn on. Clone it before drawing on it."""
+	with image_arena.untracked():
+		return Layer('', (240, 240)).as_wand()
+
+@functools.lru_cache(maxsize=None)
+def read_file(path) -> bytes:
+	with open(path, 'rb') as f:
+		return f.read()
+
+def net_image_mask_path(design_type_name):
+	return f'data/net image masks/{design_type_name}.png'
+
+@functools.lru_cache(maxsize=None)
+def net_image_mask(design_type_name) -> wand.image.Image:
+	with image_arena.untracked():
+		return wand.image.Image(blob=read_file(net_image_mask_path(design_type_name)))
+
+DUMMY_PREVIEW_IMAGE_PATH = 'data/preview image.jpg'
+
+def dummy_preview_image() -> bytes:
+	return read_file(DUMMY_PREVIEW_IMAGE_PATH)
+
+def warm_up():
+	"""Read every file that would otherwise be read on first use."""
+	for cls in Design.design_types.values():
+		if cls.pro:
+			read_file(net_image_mask_path(cls.name))
+	dummy_preview_image()
 
 class Design:
 	# shared static vars
@@ -111,8 +152,10 @@ class Design:
 		cls.one_to_one = cls.correspondence is None
 		cls.pro = len(cls.internal_layers) > 1
 
-		if cls.pro:
-			cls.net_image_mask = wand.image.Image(filename=f'data/net image masks/{cls.name}.png')
+
+	@property
+	def net_image_mask(self) -> wand.image.Image:
+		return net_image_mask(self.name)
 
 	def __new__(cls, type=None, **kwargs):
 		# this is really two constructors:
@@ -295,7 +338,7 @@ class BasicDesign(Design):
 
 class StandardBodyMixin:
 	def net_image(self):
-		net_img = NET_IMAGE_BASE.clone()
+		net_img = net_image_base().clone()
 		back = self.layer_images['back'].clone()
 		back.scale(112, 113)
 		net_img.composite(back, 6, 6)
@@ -365,7 +408,7 @@ class Hoodie(LongSleeveDressShirt):
 
 class LongBodyMixin:
 	def net_image(self):
-		net_img = NET_IMAGE_BASE.clone()
+		net_img = net_image_base().clone()
 		back = self.layer_images['back'].clone()
 		back.scale(112, 145)
 		net_img.composite(back, 6, 6)
@@ -454,7 +497,7 @@ class BrimmedCap(Design):
 	]
 
 	def net_image(self) -> wand.image.Image:
-		net_img = NET_IMAGE_BASE.clone()
+		net_img = net_image_base().clone()
 		front = self.layer_images['front'].clone()
 		front.scale(151, 146)
 		net_img.composite(front, 8, 4)
@@ -487,7 +530,7 @@ class KnitCap(Design):
 	]
 
 	def net_image(self):
-		net_img = NET_IMAGE_BASE.clone()
+		net_img = net_image_base().clone()
 		cap = self.layer_images['cap'].clone()
 		cap.scale(228, 182)
 		net_img.composite(cap, 6, 10)
@@ -516,7 +559,7 @@ class BrimmedHat(Design):
 	]
 
 	def net_image(self) -> wand.image.Image:
-		net_img = NET_IMAGE_BASE.clone()
+		net_img = net_image_base().clone()
 		top = self.layer_images['top'].clone()
 		top.scale(121, 121)
 		net_img.composite(top, 59, 9)
@@ -529,9 +572,6 @@ class BrimmedHat(Design):
 		net_img.composite(self.net_image_mask, 0, 0)
 		return net_img
 
-with open('data/preview image.jpg', 'rb') as f:
-	dummy_preview_image = f.read()
-
 LITTLE_ENDIAN_UINT32 = struct.Struct('>L')
 TWO_LITTLE_ENDIAN_UINT32S = struct.Struct('>LL')
 
@@ -554,7 +594,25 @@ def tile(image):
 	):
 		yield image[x:min(image.width, x+STANDARD_WIDTH), y:min(image.height, y+STANDARD_HEIGHT)]
 
+# how many colors the tiles of an image are quantized to together when using whole image quantization.
+# Each tile then gets the PALETTE_SIZE of these that it uses most.
+WHOLE_IMAGE_PALETTE_SIZE = 4 * PALETTE_SIZE
+
+def quantize_tiles(tiles) -> List[Tuple[bytes, XY, bool]]:
+	"""Quantize the tiles of an image against a palette shared by the whole image, so that neighbouring tiles
+	don't end up with visibly different colors. Tiles which already fit in PALETTE_SIZE colors are left alone.
+	Returns a list of (pixels, size, was_quantized) tuples.
+	"""
+	pxss = [bytes(tile_image.export_pixels()) for tile_image in tiles]
+	results = quantize.quantize_shared(pxss, shared_colors=WHOLE_IMAGE_PALETTE_SIZE)
+	QUANTIZATIONS.inc(sum(was_quantized for was_quantized, _ in results))
+	return [(pxs, tile_image.size, was_quantized) for (was_quantized, pxs), tile_image in zip(results, tiles)]
+
+# bump this whenever the output of encode() changes, so that stored payloads get re-encoded when they're refreshed
+FORMAT_VERSION = 1
+
 # TODO make this a method of Design
+@ENCODE_SECONDS.timed
 def encode(design: Design) -> dict:
 	encoded = {}
 	meta = {
@@ -578,11 +636,40 @@ def encode(design: Design) -> dict:
 	body['mMeta'] = meta
 	body['mData'] = img_data
 	encoded['body'] = msgpack.dumps(body)
-	encoded['net_image'] = design.net_image().make_blob('JPG')
-	encoded['preview_image'] = dummy_preview_image
+	with NET_IMAGE_SECONDS.time():
+		net_image = design.net_image()
+	encoded['net_image'] = net_image.make_blob('JPG')
+	encoded['preview_image'] = dummy_preview_image()
 
 	return was_quantized, encoded
 
+def content_digest(body: bytes) -> bytes:
+	"""Hash an encoded design body such that two designs which look the same in game have the same digest.
+	The island name is left out since we pick one at random for each upload.
+	"""
+	body = msgpack.loads(body)
+	del body['mMeta']['mMtVNm']
+	return hashlib.sha256(msgpack.dumps(body)).digest()
+
+def for_profile(encoded: dict, profile_id: int) -> dict:
+	"""Return a copy of an encoded design attributed to another profile, for uploading to another account."""
+	meta = msgpack.loads(encoded['meta'])
+	meta['mMtNsaId'] = profile_id
+	body = msgpack.loads(encoded['body'])
+	body['mMeta']['mMtNsaId'] = profile_id
+	return dict(encoded, meta=msgpack.dumps(meta), body=msgpack.dumps(body))
+
+def encode_basic_pixels(pixels: bytes, size: XY, *, quantized=False, **kwargs):
+	"""Encode a basic design given as raw RGBA pixels. Unlike wand images, the arguments and return value of this
+	function can be pickled, so it can be run in a process pool.
+	Pass quantized=True if the pixels were already quantized by quantize_tiles. Other kwargs are passed to BasicDesign.
+	"""
+	width, height = size
+	with wand.image.Image(width=width, height=height) as image:
+		image.import_pixels(channel_map='RGBA', data=pixels)
+		was_quantized, encoded = encode(BasicDesign(layers={'0': image}, **kwargs))
+	return quantized or was_quantized, encoded
+
 def encode_basic(design):
 	image = design.layer_images['0'].clone()
 	if image.size > STANDARD:
@@ -598,13 +685,13 @@ def encode_basic(design):
 		base_image.merge_layers('flatten')
 		image = base_image
 
-	was_quantized = maybe_quantize(image)
-
 	with image:
-		# casting to a memoryview should ensure efficient slicing
-		pxs = memoryview(bytearray(image.export_pixels()))
+		was_quantized, pxs = quantize.quantize(bytes(image.export_pixels()))
+	if was_quantized:
+		QUANTIZATIONS.inc()
 
-	return was_quantized, encode_image_data([pxs])
+	# casting to a memoryview should ensure efficient slicing
+	return was_quantized, encode_image_data([memoryview(pxs)])
 
 def encode_pro(design):
 	design.validate()
@@ -656,14 +743,8 @@ def encode_image(palette, pxs):
 	return img.getvalue()
 
 def maybe_quantize(image):
-	was_quantized = False
-	if image.colors > PALETTE_SIZE:
-		image.quantize(number_colors=PALETTE_SIZE)
-		was_quantized = True
-
-	if image.colors > PALETTE_SIZE:
-		raise RuntimeError(
-			f'generated palette has more than {PALETTE_SIZE} colors ({image.colors}) even after quantization!'
-		)
-
+	"""Quantize a wand image in place if it has more colors than a design can. Returns whether it did."""
+	was_quantized, pxs = quantize.quantize(bytes(image.export_pixels()))
+	if was_quantized:
+		image.import_pixels(channel_map='RGBA', data=pxs)
 	return was_quantized
@@ -0,0 +1,95 @@
+# © 2020 io mintz <io@mintz.cc>
+
+"""Eviction policies for the design slot pool, and a simulator to compare them against a recorded access log.
+
+The policy in use is chosen by the eviction-policy config key. garbage_collect_designs evicts in SQL
+(see the eviction_candidates query), so each policy here must sort the same way as its branch of that query.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Iterable, Tuple
+
+from utils import config
+from .api import MAX_DESIGNS
+
+DEFAULT_POLICY = 'lru'
+
+@dataclass
+class Resident:
+	"""An image whose designs are currently uploaded, as far as the simulator is concerned."""
+	slots: int
+	created_at: float
+	last_accessed_at: float
+	access_count: int = 0
+
+# sort keys, least valuable first
+POLICIES = {
+	# the oldest upload, regardless of use
+	'fifo': lambda resident: (resident.created_at,),
+	# the least recently used, treating the upload as a use
+	'lru': lambda resident: (resident.last_accessed_at,),
+	# the least used, breaking ties by recency
+	'lfu': lambda resident: (resident.access_count, resident.last_accessed_at),
+}
+
+def policy() -> str:
+	"""Return the name of the configured eviction policy."""
+	name = config.get('eviction-policy', DEFAULT_POLICY)
+	if name not in POLICIES:
+		raise ValueError(f'unknown eviction-policy {name!r}; expected one of {", ".join(POLICIES)}')
+	return name
+
+@dataclass
+class SimulationResult:
+	policy: str
+	uploads: int = 0
+	accesses: int = 0
+	refreshes: int = 0
+	evictions: int = 0
+
+	@property
+	def refresh_rate(self) -> float:
+		"""The fraction of accesses to an existing image which found it evicted."""
+		return self.refreshes / self.accesses if self.accesses else 0.0
+
+def simulate(events: Iterable[Tuple[int, int, float]], policy_name: str, *, slots=MAX_DESIGNS) -> SimulationResult:
+	"""Replay events, an iterable of (image_id, designs_required, timestamp) tuples for one slot pool in order,
+	against the given policy.
+
+	The first event for each image is its upload, and every later one is an access. An access to an image
+	that has been evicted counts as a refresh, which uploads it again. Images are evicted whole,
+	since every design of an image is accessed together when the image is viewed.
+	"""
+	key = POLICIES[policy_name]
+	result = SimulationResult(policy_name)
+	seen = set()
+	resident: Dict[int, Resident] = {}
+	used = 0
+
+	for image_id, designs_required, timestamp in events:
+		if image_id in resident:
+			result.accesses += 1
+			resident[image_id].last_accessed_at = timestamp
+			resident[image_id].access_count += 1
+			continue
+
+		if image_id in seen:
+			result.accesses += 1
+			result.refreshes += 1
+		else:
+			seen.add(image_id)
+			result.uploads += 1
+
+		if designs_required > slots:
+			continue
+
+		# evict until there's room
+		while slots - used < designs_required:
+			victim = min(resident, key=lambda other: key(resident[other]))
+			used -= resident.pop(victim).slots
+			result.evictions += 1
+
+		resident[image_id] = Resident(designs_required, timestamp, timestamp)
+		used += designs_required
+
+	return result
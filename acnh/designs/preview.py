@@ -0,0 +1,29 @@
+# © 2020 io mintz <io@mintz.cc>
+
+from typing import List, Tuple
+
+from .encode import Design, NET_IMAGE_SECONDS
+from utils import make_png, xbrz_scale_wand_in_subprocess
+
+# how much to scale each layer by when displaying it on the image page
+SCALE_FACTOR = 6
+
+def render(design: Design, *, scale: bool) -> Tuple[bytes, List[bytes]]:
+	"""Render the PNGs displayed for an image: its net image, and each of its layers in external layer order.
+	If scale is true, layers are scaled up using xBRZ.
+	"""
+	with NET_IMAGE_SECONDS.time():
+		net_image = design.net_image()
+	with net_image:
+		net_image_png = make_png(net_image)
+
+	layers = []
+	for layer in design.external_layers:
+		image = design.layer_images[layer.name]
+		if scale:
+			with xbrz_scale_wand_in_subprocess(image, SCALE_FACTOR) as scaled:
+				layers.append(make_png(scaled))
+		else:
+			layers.append(make_png(image))
+
+	return net_image_png, layers
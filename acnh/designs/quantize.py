@@ -0,0 +1,148 @@
+# © 2020 io mintz <io@mintz.cc>
+
+"""Color quantization of raw RGBA pixel buffers, as returned by wand's Image.export_pixels().
+
+Palettes are generated by median cut and then refined with a few rounds of k-means. Everything is deterministic,
+so the same pixels always quantize to the same result.
+"""
+
+from typing import List, Tuple
+
+import numpy as np
+
+from .format import PALETTE_SIZE
+
+# shifts to unpack a big endian RGBA uint32 into its channels
+CHANNEL_SHIFTS = np.array([24, 16, 8, 0], dtype=np.uint32)
+KMEANS_ITERATIONS = 4
+
+def unpack(pxs: bytes):
+	"""Return the distinct colors of pxs as an N×4 array of channels, how to rebuild pxs from them, and their counts."""
+	packed = np.frombuffer(pxs, dtype='>u4')
+	colors, inverse, counts = np.unique(packed, return_inverse=True, return_counts=True)
+	channels = (colors[:, None].astype(np.uint32) >> CHANNEL_SHIFTS) & 0xFF
+	return channels.astype(np.float64), inverse, counts
+
+def pack(channels) -> np.ndarray:
+	channels = np.clip(np.rint(channels), 0, 255).astype(np.uint32)
+	return (channels << CHANNEL_SHIFTS).sum(axis=1, dtype=np.uint32)
+
+def count_colors(pxs: bytes) -> int:
+	return len(np.unique(np.frombuffer(pxs, dtype='>u4')))
+
+def quantize(pxs: bytes, colors=PALETTE_SIZE) -> Tuple[bool, bytes]:
+	"""Reduce pxs to at most the given number of colors.
+	Returns (was_quantized, pixels), where was_quantized is false if pxs already had few enough colors,
+	in which case pixels is pxs unchanged.
+	"""
+	channels, inverse, counts = unpack(pxs)
+	if len(channels) <= colors:
+		return False, pxs
+
+	palette = generate_palette(channels, counts, colors)
+	return True, remap(channels, inverse, palette)
+
+def quantize_shared(pxss: List[bytes], *, shared_colors: int, colors=PALETTE_SIZE) -> List[Tuple[bool, bytes]]:
+	"""Quantize several images (e.g. the tiles of one large image) against one palette of shared_colors colors,
+	then reduce each of them to its own subset of at most colors of that palette.
+	Images that already have few enough colors are left alone.
+	Returns a list of (was_quantized, pixels) tuples in the same order as pxss.
+	"""
+	needs_quantizing = [count_colors(pxs) > colors for pxs in pxss]
+	if not any(needs_quantizing):
+		return [(False, pxs) for pxs in pxss]
+
+	combined = b''.join(pxs for pxs, needed in zip(pxss, needs_quantizing) if needed)
+	channels, _, counts = unpack(combined)
+	palette = generate_palette(channels, counts, shared_colors)
+
+	rv = []
+	for pxs, needed in zip(pxss, needs_quantizing):
+		if not needed:
+			rv.append((False, pxs))
+			continue
+
+		channels, inverse, counts = unpack(pxs)
+		nearest = nearest_colors(channels, palette)
+		# the palette entries that this image uses most
+		usage = np.bincount(nearest, weights=counts, minlength=len(palette))
+		# always keep transparency if this image has any
+		usage[(palette[:, 3] == 0) & (usage > 0)] = np.inf
+		subset = palette[np.argsort(-usage, kind='stable')[:min(colors, np.count_nonzero(usage))]]
+		rv.append((True, remap(channels, inverse, subset)))
+
+	return rv
+
+def generate_palette(channels, counts, colors):
+	"""Generate a palette of at most the given number of colors for the given distinct colors and their counts."""
+	transparent = channels[:, 3] == 0
+	opaque_channels = channels[~transparent]
+	opaque_counts = counts[~transparent]
+
+	# all fully transparent pixels look the same, so they share one palette entry
+	palette = [np.zeros((1, 4))] if transparent.any() else []
+	opaque_colors = colors - len(palette)
+	if len(opaque_channels) and opaque_colors:
+		opaque_palette = median_cut(opaque_channels, opaque_counts, opaque_colors)
+		palette.append(kmeans(opaque_channels, opaque_counts, opaque_palette))
+
+	return np.concatenate(palette)
+
+def median_cut(channels, counts, colors):
+	boxes = [np.arange(len(channels))]
+	while len(boxes) < colors:
+		best_score = 0
+		best = None
+		for i, box in enumerate(boxes):
+			if len(box) < 2:
+				continue
+			ranges = channels[box].max(axis=0) - channels[box].min(axis=0)
+			score = ranges.max() * counts[box].sum()
+			if score > best_score:
+				best_score = score
+				best = i, int(ranges.argmax())
+
+		if best is None:
+			# every remaining box is a single color
+			break
+
+		i, channel = best
+		box = boxes.pop(i)
+		box = box[np.argsort(channels[box, channel], kind='stable')]
+		cumulative = np.cumsum(counts[box])
+		split = int(np.searchsorted(cumulative, cumulative[-1] / 2))
+		split = min(max(split, 1), len(box) - 1)
+		boxes[i:i] = [box[:split], box[split:]]
+
+	return np.array([np.average(channels[box], axis=0, weights=counts[box]) for box in boxes])
+
+def kmeans(channels, counts, palette):
+	for _ in range(KMEANS_ITERATIONS):
+		nearest = nearest_colors(channels, palette)
+		weights = np.bincount(nearest, weights=counts, minlength=len(palette))
+		sums = np.stack([
+			np.bincount(nearest, weights=channels[:, c] * counts, minlength=len(palette))
+			for c in range(4)
+		], axis=1)
+		# leave clusters that lost all their colors where they were
+		used = weights > 0
+		palette = palette.copy()
+		palette[used] = sums[used] / weights[used, None]
+
+	return palette
+
+def nearest_colors(channels, palette):
+	"""Return the index of the nearest palette entry to each color."""
+	distances = ((premultiply(channels)[:, None, :] - premultiply(palette)[None, :, :]) ** 2).sum(axis=2)
+	return distances.argmin(axis=1)
+
+def premultiply(channels):
+	"""Scale the color channels by alpha, so that the color of mostly transparent pixels matters less,
+	and the color of fully transparent ones doesn't matter at all.
+	"""
+	alpha = channels[:, 3:] / 255
+	return np.concatenate([channels[:, :3] * alpha, channels[:, 3:]], axis=1)
+
+def remap(channels, inverse, palette) -> bytes:
+	mapped = pack(palette)[nearest_colors(channels, palette)]
+	return mapped[inverse.reshape(-1)].astype('>u4').tobytes()
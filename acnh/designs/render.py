@@ -4,10 +4,15 @@
 import io
 import wand.image
 
+import metrics
 from .encode import Design
 from .format import WIDTH, HEIGHT
 from ..errors import InvalidLayerIndexError, InvalidLayerNameError
 
+RENDER_LAYERS_SECONDS = metrics.histogram(
+	'acplaza_render_layers_seconds', 'Time taken to render every layer of a design from its raw data.',
+)
+
 def gen_palette(raw_image):
 	palette = {}
 	for ind, color in raw_image['mPalette'].items():
@@ -49,9 +54,12 @@ def render_layer_name(data, layer_name) -> wand.image.Image:
 	except KeyError:
 		raise InvalidLayerNameError(design)
 
+@RENDER_LAYERS_SECONDS.timed
 def render_layers(raw_image):
 	palette = gen_palette(raw_image)
+	layers = []
 	# idk there's probably some python nerd `map` thing you can do here I'm a
 	# C programmer so I like the word `for` more than that functional nonsense
 	for layer_i, layer in raw_image['mData'].items():
-		yield int(layer_i), _render_layer(raw_image, palette, layer)
+		layers.append((int(layer_i), _render_layer(raw_image, palette, layer)))
+	return layers
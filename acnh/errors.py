@@ -88,6 +88,7 @@ class InvalidScaleFactorError(InvalidFormatError):
 class InvalidLayerIndexError(DesignError):
 	code = 206
 	message = 'Invalid layer index'
+	http_status = HTTPStatus.NOT_FOUND
 
 	def __init__(self, *, num_layers):
 		super().__init__()
@@ -96,6 +97,7 @@ class InvalidLayerIndexError(DesignError):
 	def to_dict(self):
 		d = super().to_dict()
 		d['num_layers'] = self.num_layers
+		return d
 
 class InvalidLayerNameError(DesignError):
 	code = 207
@@ -136,6 +138,11 @@ class InvalidPaletteError(DesignError):
 class DesignLitTheServerOnFireError(InvalidDesignError, DesignError):
 	code = 212
 
+class InvalidArchiveFormatError(DesignError, InvalidFormatError):
+	code = 213
+	message = 'invalid archive format'
+	regex = re.compile(r'tar|tar\.gz|zip')
+
 class UnknownImageIdError(ImageError):
 	code = 301
 	message = 'unknown image ID'
@@ -179,13 +186,17 @@ class TiledImageTooBigError(ImageError):
 	)
 	http_status = HTTPStatus.REQUEST_ENTITY_TOO_LARGE
 
-	def __init__(self, img):
+	def __init__(self, width, height):
 		super().__init__()
-		self.num_tiles = num_tiles(*img.size)
+		self.num_tiles = num_tiles(width, height)
 
 	@classmethod
 	def validate(cls, img):
-		ex = cls(img)
+		cls.validate_size(*img.size)
+
+	@classmethod
+	def validate_size(cls, width, height):
+		ex = cls(width, height)
 		if ex.num_tiles > MAX_DESIGN_TILES:
 			raise ex
 
@@ -250,6 +261,41 @@ class ImageNameTooLongError(ImageError):
 		d['max_length'] = self.max_len
 		return d
 
+class UnknownImageJobIdError(ImageError):
+	code = 313
+	message = 'unknown image job ID'
+	http_status = HTTPStatus.NOT_FOUND
+
+class InvalidImageJobIdError(ImageError, InvalidFormatError):
+	code = 314
+	message = 'invalid image job ID'
+	regex = re.compile(r'[0-9]+')
+
+class ImageJobFailedError(ImageError):
+	code = 315
+	message = 'an internal error occurred while uploading this image'
+	http_status = HTTPStatus.INTERNAL_SERVER_ERROR
+
+class ImageTooManyPixelsError(ImageError):
+	code = 316
+	message = 'The uploaded image has {0.num_pixels} pixels, which is greater than the limit, {0.max_pixels}.'
+	http_status = HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+
+	def __init__(self, num_pixels, max_pixels):
+		super().__init__()
+		self.num_pixels = num_pixels
+		self.max_pixels = max_pixels
+
+	def to_dict(self):
+		d = super().to_dict()
+		d['max_pixels'] = self.max_pixels
+		return d
+
+class ImageJobStreamTimeoutError(ImageError):
+	code = 317
+	message = 'the image job did not finish in time; stream it again to keep waiting'
+	http_status = HTTPStatus.GATEWAY_TIMEOUT
+
 class InvalidPaginationError(ACNHError):
 	http_status = HTTPStatus.BAD_REQUEST
 
@@ -262,6 +308,11 @@ class InvalidPaginationLimitError(InvalidFormatError, InvalidPaginationError):
 	message = 'Invalid limit passed'
 	regex = re.compile('[0-9]+')
 
+class InvalidPaginationOffsetError(InvalidFormatError, InvalidPaginationError):
+	code = 403
+	message = 'Invalid offset passed'
+	regex = re.compile('[0-9]+')
+
 class AuthorizationError(ACNHError):
 	pass
 
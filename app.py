@@ -5,16 +5,43 @@ from glob import glob
 
 from flask import Flask
 
+import image_arena
+import profiler
 import utils
 import acnh.common
+import acnh.designs.encode
 import views.api
 import views.frontend
+import views.metrics
+import views.profiler
 
 app = Flask(__name__)
 utils.init_app(app)
+image_arena.init_app(app)
 acnh.common.init_app(app)
 views.frontend.init_app(app)
 views.api.init_app(app)
+views.metrics.init_app(app)
+profiler.init_app(app)
+views.profiler.init_app(app)
+
+def warm_up():
+	"""Load everything that would otherwise be loaded on first use, so that it's loaded once
+	by the uWSGI master process and shared by the workers it forks, rather than loaded again by every worker.
+	"""
+	utils.python_executable()
+	acnh.common.warm_up()
+	acnh.designs.encode.warm_up()
+	for template_name in app.jinja_env.list_templates():
+		app.jinja_env.get_template(template_name)
+
+try:
+	import uwsgi  # pylint: disable=unused-import
+except ImportError:
+	# not running under uWSGI, e.g. a script which only needs the app context
+	pass
+else:
+	warm_up()
 
 if __name__ == '__main__':
 	app.run(use_reloader=True, extra_files=glob('templates/**.html', recursive=True) + ['queries.sql'])
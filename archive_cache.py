@@ -0,0 +1,47 @@
+# © 2020 io mintz <io@mintz.cc>
+
+"""A size bounded on-disk cache of image archives.
+
+Images never change after they're created, so each archive only has to be built once per set of options.
+Files are named after the options they were built with, and the least recently served ones are deleted
+when the cache grows past archive-cache-max-size. The cache is disabled unless archive-cache-dir is set.
+"""
+
+from pathlib import Path
+from typing import Iterable, Optional
+
+import disk_cache
+from utils import config
+
+DEFAULT_MAX_SIZE = 1024 ** 3
+
+def cache_dir() -> Optional[Path]:
+	path = config.get('archive-cache-dir')
+	return None if path is None else Path(path)
+
+def enabled() -> bool:
+	return cache_dir() is not None
+
+def filename(image_id, *, scale_factor, internal_layers, archive_format) -> str:
+	return f'{image_id}-{scale_factor}x{"-internal" if internal_layers else ""}.{archive_format}'
+
+def lookup(name) -> Optional[Path]:
+	"""Return the path of the cached archive with the given filename, or None if it's not cached."""
+	return disk_cache.lookup(cache_dir(), name)
+
+def write_through(name, chunks: Iterable[bytes]):
+	"""Yield chunks while also writing them to the cache under the given filename.
+	The archive is only added to the cache once every chunk has been written, so if the client goes away
+	before then, nothing is cached.
+	"""
+	yield from disk_cache.write_through(cache_dir(), name, chunks)
+	evict()
+
+def evict():
+	"""Delete the least recently used archives until the cache fits in archive-cache-max-size."""
+	disk_cache.evict(cache_dir(), config.get('archive-cache-max-size', DEFAULT_MAX_SIZE))
+
+def forget(image_id):
+	"""Delete every cached archive of an image."""
+	if enabled():
+		disk_cache.forget(cache_dir(), f'{image_id}-*')
@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+
+# Render and store the previews of every image created before previews were stored at creation time.
+
+import image_arena
+from app import app
+from utils import pg, queries
+from acnh.designs.db import image_previews
+
+with app.app_context():
+	image_ids = pg().fetchvals(queries.images_without_previews())
+	for i, image_id in enumerate(image_ids, 1):
+		with image_arena.arena():
+			image_previews(image_id)
+		print(f'{i}/{len(image_ids)}', image_id)
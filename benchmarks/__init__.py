@@ -0,0 +1,63 @@
+# © 2020 io mintz <io@mintz.cc>
+
+import random
+import timeit
+
+import msgpack
+import wand.image
+
+from acnh.designs import encode
+from acnh.designs.format import MAX_NAME_LEN, PALETTE_SIZE
+
+def measure(func, *, repeat=5, number=1) -> float:
+	"""Return the best time in seconds per call of func over repeat runs of number calls each."""
+	return min(timeit.repeat(func, repeat=repeat, number=number)) / number
+
+def fixture_image(width, height, *, seed=0) -> wand.image.Image:
+	"""Return a deterministic photo-like image: a gradient with some noise, so that it has plenty of colors."""
+	rng = random.Random(seed)
+	pxs = bytearray()
+	for y in range(height):
+		for x in range(width):
+			noise = rng.randrange(32)
+			pxs += bytes((
+				x * 223 // width + noise,
+				y * 223 // height + noise,
+				(x + y) * 111 // (width + height) + noise,
+				255,
+			))
+
+	img = wand.image.Image(width=width, height=height)
+	img.import_pixels(channel_map='RGBA', data=pxs)
+	return img
+
+def fixture_palette_image(width, height, *, seed=0, colors=PALETTE_SIZE) -> wand.image.Image:
+	"""Return a deterministic image with only the given number of colors, which are the same for every seed,
+	so that the layers of a Pro design made from these fit in one palette.
+	"""
+	palette_rng = random.Random(-1)
+	palette = [bytes((*(palette_rng.randrange(256) for _ in range(3)), 255)) for _ in range(colors)]
+	rng = random.Random(seed)
+	pxs = b''.join(rng.choice(palette) for _ in range(width * height))
+
+	img = wand.image.Image(width=width, height=height)
+	img.import_pixels(channel_map='RGBA', data=pxs)
+	return img
+
+def fixture_design(cls, *, seed=0):
+	"""Return a design of the given type with a fixture image for each layer."""
+	return cls(
+		island_name='Benchmark',
+		design_name=cls.display_name[:MAX_NAME_LEN],
+		layers={
+			layer.name: fixture_palette_image(*layer.size, seed=seed + i)
+			for i, layer in enumerate(cls.external_layers)
+		},
+	)
+
+def fixture_data(design) -> dict:
+	"""Return design encoded as if it had been downloaded, for Design.from_data."""
+	_, encoded = encode.encode(design)
+	data = msgpack.loads(encoded['body'])
+	data.update(author_id=0, author_name='Benchmark', created_at=1600000000)
+	return data
@@ -0,0 +1,76 @@
+# © 2020 io mintz <io@mintz.cc>
+
+"""Run every benchmark, and optionally save the results or compare them against saved ones.
+Run from the repository root: python -m benchmarks --help
+"""
+
+import argparse
+import json
+import sys
+from typing import Dict, List
+
+from . import archive, designs, measure, quantize, startup, xbrz
+
+MODULES = [designs, quantize, xbrz, archive, startup]
+# how much slower than the baseline a benchmark may get before it counts as a regression
+DEFAULT_THRESHOLD = 0.1
+
+def run(pattern=None) -> Dict[str, float]:
+	"""Run every benchmark whose name contains pattern, returning the best time in seconds for each by name."""
+	results = {}
+	for module in MODULES:
+		for name, func in module.benchmarks():
+			if pattern and pattern not in name:
+				continue
+			results[name] = seconds = measure(func)
+			print(f'{name}: {seconds * 1000:.2f} ms', flush=True)
+	return results
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], *, threshold) -> List[str]:
+	"""Print how each result changed from baseline, and return the names of those which regressed."""
+	regressions = []
+	for name, seconds in results.items():
+		if name not in baseline:
+			continue
+		change = seconds / baseline[name] - 1
+		if change > threshold:
+			regressions.append(name)
+			verdict = ' REGRESSION'
+		elif change < -threshold:
+			verdict = ' improvement'
+		else:
+			verdict = ''
+		print(f'{name}: {baseline[name] * 1000:.2f} → {seconds * 1000:.2f} ms ({change:+.1%}){verdict}')
+	return regressions
+
+def main():
+	parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__.splitlines()[0])
+	parser.add_argument('-k', dest='pattern', help='only run the benchmarks whose names contain this')
+	parser.add_argument('--save', metavar='PATH', help='write the results to this JSON file')
+	parser.add_argument(
+		'--compare', metavar='PATH', help='compare the results against a JSON file written by --save, '
+		'and exit with status 1 if any regressed',
+	)
+	parser.add_argument(
+		'--threshold', type=float, default=DEFAULT_THRESHOLD,
+		help='how much slower a benchmark may get before it counts as a regression (default: %(default)s, i.e. 10%%)',
+	)
+	args = parser.parse_args()
+
+	results = run(args.pattern)
+
+	if args.save:
+		with open(args.save, 'w') as f:
+			json.dump(results, f, indent='\t', ensure_ascii=False)
+
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = json.load(f)
+		print()
+		regressions = compare(results, baseline, threshold=args.threshold)
+		if regressions:
+			print(f'\n{len(regressions)} regressed by more than {args.threshold:.0%}:', ', '.join(regressions))
+			sys.exit(1)
+
+if __name__ == '__main__':
+	main()
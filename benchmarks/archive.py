@@ -0,0 +1,91 @@
+# © 2020 io mintz <io@mintz.cc>
+
+"""Compare the size and CPU cost of each archive format offered for layer downloads,
+and time make_archive, which also renders the layers, for each format.
+Run from the repository root: python -m benchmarks.archive
+"""
+
+import functools
+import time
+
+import tar_stream
+import zip_stream
+from acnh.designs.encode import ShortSleeveTee
+from . import measure, fixture_design, fixture_image
+
+# a Pro design has up to four layers, each 32×32 before scaling
+LAYERS = 4
+SCALE_FACTORS = [1, 6]
+MTIME = 1600000000
+
+def fixture_pngs(scale_factor):
+	pngs = []
+	for seed in range(LAYERS):
+		with fixture_image(32, 32, seed=seed) as image:
+			if scale_factor != 1:
+				# nearest neighbour is close enough to xBRZ for the purpose of comparing sizes
+				image.sample(32 * scale_factor, 32 * scale_factor)
+			pngs.append(image.make_blob('png'))
+	return pngs
+
+def tar(pngs):
+	archive = tar_stream.TarWriter()
+	for i, png in enumerate(pngs):
+		yield from archive.addfile(f'design/{i}.png', MTIME, png)
+	yield from archive.footer()
+
+def tar_gz(pngs):
+	return tar_stream.gzip_stream(tar(pngs), filename='design.tar', mtime=MTIME)
+
+def zip_(pngs):
+	archive = zip_stream.ZipWriter()
+	for i, png in enumerate(pngs):
+		yield from archive.addfile(f'design/{i}.png', MTIME, png)
+	yield from archive.footer()
+
+FORMATS = {'tar': tar, 'tar.gz': tar_gz, 'zip': zip_}
+
+def consume(chunks) -> int:
+	"""Exhaust chunks, returning the number of bytes that would have been sent."""
+	return sum(len(chunk) for chunk in chunks)
+
+def cpu_time(func, *, repeat=5):
+	"""Return the least CPU time in seconds used by a call to func."""
+	times = []
+	for _ in range(repeat):
+		start = time.process_time()
+		func()
+		times.append(time.process_time() - start)
+	return min(times)
+
+def archive_design(design, *, scale_factor, archive_format):
+	# imported here since views.api needs the game credentials to be configured
+	from views.api import make_archive  # pylint: disable=import-outside-toplevel
+	return consume(make_archive(
+		design.design_name, MTIME, design.layer_images.items(), scale_factor=scale_factor, archive_format=archive_format,
+	))
+
+def benchmarks():
+	for scale_factor in SCALE_FACTORS:
+		pngs = fixture_pngs(scale_factor)
+		for format_name, make in FORMATS.items():
+			yield f'{format_name} {scale_factor}x', lambda make=make, pngs=pngs: consume(make(pngs))
+
+	# the layers are rendered by other processes, so only the wall time of these is meaningful
+	design = fixture_design(ShortSleeveTee)
+	for scale_factor in SCALE_FACTORS:
+		for format_name in FORMATS:
+			yield f'make_archive {format_name} {scale_factor}x', functools.partial(
+				archive_design, design, scale_factor=scale_factor, archive_format=format_name,
+			)
+
+def main():
+	for name, func in benchmarks():
+		print(
+			f'{name}: {func()} bytes,',
+			f'{measure(func) * 1000:.2f} ms wall,',
+			f'{cpu_time(func) * 1000:.2f} ms CPU',
+		)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,83 @@
+# © 2020 io mintz <io@mintz.cc>
+
+"""Time each stage of the design pipeline, for every type of design and for tiled basic images.
+Run from the repository root: python -m benchmarks.designs
+"""
+
+from acnh.designs import encode, render
+from acnh.designs.encode import BasicDesign, Design
+from acnh.designs.format import MAX_DESIGN_TILES, WIDTH, HEIGHT
+from . import measure, fixture_data, fixture_design, fixture_image
+
+# (columns, rows) of tiles, from a single design up to the most an image may be split into
+TILINGS = [(1, 1), (2, 1), (2, 2), (4, 2), (4, MAX_DESIGN_TILES // 4)]
+
+def design_types():
+	# sorted so that results line up between runs
+	return sorted(set(Design.design_types.values()), key=lambda cls: cls.type_code)
+
+def close_all(images):
+	for image in images:
+		image.close()
+
+def net_image(design):
+	with design.net_image():
+		pass
+
+def internalize(design):
+	if design.one_to_one:
+		# these are the design's own layers, so they mustn't be closed
+		design.internalize()
+	else:
+		close_all(design.internalize())
+
+def externalize(cls, internal_layers):
+	design = cls.externalize(internal_layers)
+	if not cls.one_to_one:
+		close_all(design.layer_images.values())
+
+def render_layers(data):
+	close_all(image for _, image in render.render_layers(data['mData']))
+
+def from_data(data):
+	close_all(Design.from_data(data).layer_images.values())
+
+def encode_tiles(image):
+	tiles = list(encode.tile(image))
+	try:
+		for tile in tiles:
+			encode.maybe_quantize(tile)
+			encode.encode(BasicDesign(island_name='Benchmark', design_name='Benchmark', layers={'0': tile}))
+	finally:
+		close_all(tiles)
+
+def quantize_tiles(image):
+	for tile in encode.tile(image):
+		with tile:
+			encode.maybe_quantize(tile)
+
+def benchmarks():
+	for cls in design_types():
+		design = fixture_design(cls)
+		data = fixture_data(design)
+		internal_layers = design.internalize()
+		name = cls.name
+		yield f'render_layers {name}', lambda data=data: render_layers(data)
+		yield f'from_data {name}', lambda data=data: from_data(data)
+		yield f'internalize {name}', lambda design=design: internalize(design)
+		yield f'externalize {name}', lambda cls=cls, layers=internal_layers: externalize(cls, layers)
+		yield f'net_image {name}', lambda design=design: net_image(design)
+		yield f'encode {name}', lambda design=design: encode.encode(design)
+
+	for columns, rows in TILINGS:
+		image = fixture_image(columns * WIDTH, rows * HEIGHT)
+		size = f'{image.width}×{image.height}'
+		yield f'maybe_quantize {size}', lambda image=image: quantize_tiles(image)
+		yield f'encode tiles {size}', lambda image=image: encode_tiles(image)
+
+def main():
+	for name, func in benchmarks():
+		print(f'{name}: {measure(func) * 1000:.2f} ms')
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,46 @@
+# © 2020 io mintz <io@mintz.cc>
+
+"""Compare ways of quantizing the tiles of a basic image.
+Run from the repository root: python -m benchmarks.quantize
+"""
+
+from acnh.designs import encode
+from acnh.designs.format import PALETTE_SIZE
+from . import measure, fixture_image
+
+SIZES = [(32, 32), (64, 64), (128, 128)]
+
+def imagemagick_each_tile(image):
+	"""What maybe_quantize used to do, for comparison."""
+	for tile in encode.tile(image):
+		with tile, tile.clone() as clone:
+			if clone.colors > PALETTE_SIZE:
+				clone.quantize(number_colors=PALETTE_SIZE)
+
+def quantize_each_tile(image):
+	for tile in encode.tile(image):
+		with tile, tile.clone() as clone:
+			encode.maybe_quantize(clone)
+
+def quantize_whole_image(image):
+	tiles = list(encode.tile(image))
+	try:
+		encode.quantize_tiles(tiles)
+	finally:
+		for tile in tiles:
+			tile.close()
+
+def benchmarks():
+	for width, height in SIZES:
+		image = fixture_image(width, height)
+		size = f'{width}×{height}'
+		yield f'quantize per tile (ImageMagick) {size}', lambda image=image: imagemagick_each_tile(image)
+		yield f'quantize per tile {size}', lambda image=image: quantize_each_tile(image)
+		yield f'quantize whole image {size}', lambda image=image: quantize_whole_image(image)
+
+def main():
+	for name, func in benchmarks():
+		print(f'{name}: {measure(func) * 1000:.2f} ms')
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,32 @@
+# © 2020 io mintz <io@mintz.cc>
+
+"""Time how long a fresh process takes to start: importing the app, as every script does,
+and warming it up, as the uWSGI master does before forking the workers.
+Run from the repository root: python -m benchmarks.startup
+"""
+
+import subprocess
+import sys
+
+from . import measure
+
+STARTUPS = {
+	'import utils': 'import utils',
+	'import app': 'import app',
+	'import app + warm_up': 'import app; app.warm_up()',
+}
+
+def run_python(code):
+	subprocess.run([sys.executable, '-c', code], check=True)
+
+def benchmarks():
+	for name, code in STARTUPS.items():
+		yield f'startup {name}', lambda code=code: run_python(code)
+
+def main():
+	for name, func in benchmarks():
+		# each run starts a new interpreter, so fewer are needed to get a stable number
+		print(f'{name}: {measure(func, repeat=3) * 1000:.2f} ms')
+
+if __name__ == '__main__':
+	main()
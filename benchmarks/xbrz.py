@@ -0,0 +1,30 @@
+# © 2020 io mintz <io@mintz.cc>
+
+"""Time xBRZ scaling at each scale factor offered by the API, including the PNG encode that always follows it.
+Run from the repository root: python -m benchmarks.xbrz
+"""
+
+import utils
+from acnh.designs.format import WIDTH, HEIGHT
+from . import measure, fixture_palette_image
+
+SCALE_FACTORS = range(2, 7)
+
+def scale(image, factor):
+	with utils.xbrz_scale_wand_in_subprocess(image, factor) as scaled:
+		utils.make_png(scaled)
+
+def benchmarks():
+	image = fixture_palette_image(WIDTH, HEIGHT)
+	pixels = bytes(image.export_pixels(channel_map='RGBA'))
+	for factor in SCALE_FACTORS:
+		yield f'xbrz {factor}x', lambda factor=factor: scale(image, factor)
+	for factor in [1, *SCALE_FACTORS]:
+		yield f'layer_png {factor}x', lambda factor=factor: utils.layer_png(pixels, image.size, factor)
+
+def main():
+	for name, func in benchmarks():
+		print(f'{name}: {measure(func) * 1000:.2f} ms')
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,84 @@
+# © 2020 io mintz <io@mintz.cc>
+
+"""Storage shared by the size bounded on-disk caches (see archive_cache and page_cache).
+
+Entries are files named by their cache keys. They're written to temporary files first and then renamed into place,
+so readers never see a partial entry, and several workers can share one directory.
+"""
+
+import contextlib
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+# temporary files older than this were left behind by a worker that died while writing them
+STALE_TEMP_FILE_AGE = 60 * 60
+TEMP_FILE_PREFIX = '.'
+# mkstemp creates files that only their owner can read, but entries may be served by another user, such as nginx
+# (see archive-cache-accel-redirect). The umask can only be read by setting it, so do that once, before any threads.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+ENTRY_MODE = 0o644 & ~_UMASK
+
+def lookup(directory: Path, name) -> Optional[Path]:
+	"""Return the path of the entry with the given name, or None if there isn't one."""
+	path = directory / name
+	try:
+		# mark it as recently used
+		os.utime(path)
+	except FileNotFoundError:
+		return None
+	return path
+
+def write_through(directory: Path, name, chunks: Iterable[bytes]):
+	"""Yield chunks while also writing them to an entry with the given name.
+	The entry is only added once every chunk has been written, so if the caller stops early, nothing is added.
+	"""
+	directory.mkdir(parents=True, exist_ok=True)
+	fd, temp_path = tempfile.mkstemp(dir=directory, prefix=TEMP_FILE_PREFIX)
+	try:
+		with os.fdopen(fd, 'wb') as f:
+			for chunk in chunks:
+				f.write(chunk)
+				yield chunk
+		os.chmod(temp_path, ENTRY_MODE)
+		os.replace(temp_path, directory / name)
+	except BaseException:
+		with contextlib.suppress(FileNotFoundError):
+			os.unlink(temp_path)
+		raise
+
+def write(directory: Path, name, data: bytes):
+	for _ in write_through(directory, name, [data]):
+		pass
+
+def evict(directory: Path, max_size: int):
+	"""Delete the least recently used entries until the directory holds no more than max_size bytes."""
+	now = time.time()
+	entries = []
+	for entry in os.scandir(directory):
+		with contextlib.suppress(FileNotFoundError):
+			stat = entry.stat()
+			if entry.name.startswith(TEMP_FILE_PREFIX):
+				if now - stat.st_mtime > STALE_TEMP_FILE_AGE:
+					os.unlink(entry.path)
+				continue
+			entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+	total = sum(size for _, size, _ in entries)
+	entries.sort()
+	for _, size, path in entries:
+		if total <= max_size:
+			break
+		# another worker may have evicted it first
+		with contextlib.suppress(FileNotFoundError):
+			os.unlink(path)
+		total -= size
+
+def forget(directory: Path, pattern):
+	"""Delete every entry whose name matches the given glob pattern."""
+	for path in directory.glob(pattern):
+		with contextlib.suppress(FileNotFoundError):
+			path.unlink()
@@ -0,0 +1,144 @@
+# © 2020 io mintz <io@mintz.cc>
+
+"""Request scoped lifetimes for ImageMagick images, and limits on the resources ImageMagick may use.
+
+Wand only frees an image when it's closed, so an image which never is (because it was created without a with
+statement, say, or by a generator that the client abandoned) stays in memory until the process exits.
+Every wand.image.Image created while an arena is open is recorded in it, and closing the arena closes those which
+are still open. Each request gets an arena, which is closed once its response has been sent, including any
+streamed body. Closing an image twice is harmless, so code which closes its own images needn't change.
+
+Images which are meant to outlive the request, such as those cached by acnh.designs.encode,
+must be created inside untracked().
+"""
+
+import contextlib
+import functools
+import os
+import threading
+from typing import List, Optional
+
+import wand.image
+import wand.resource
+from flask import request
+
+import metrics
+from utils import config
+
+PEAK_BYTES = metrics.histogram(
+	'acplaza_imagemagick_peak_bytes',
+	'The most memory (including memory mapped files) that ImageMagick used at once while serving a request.',
+	labels=['endpoint'],
+	# 1 MiB to 2 GiB
+	buckets=[2 ** n for n in range(20, 32)],
+)
+UNCLOSED_IMAGES = metrics.counter(
+	'acplaza_unclosed_images_total', 'Images which were still open at the end of the request that created them.',
+	labels=['endpoint'],
+)
+
+def apply_limits():
+	"""Set ImageMagick's resource limits from the imagemagick-limits table of config.toml."""
+	for resource, limit in config.get('imagemagick-limits', {}).items():
+		wand.resource.limits[resource] = limit
+
+def memory_usage() -> int:
+	"""Return how many bytes of memory and memory mapped files ImageMagick is using in this process."""
+	return wand.resource.limits.resource('memory') + wand.resource.limits.resource('map')
+
+def is_open(image) -> bool:
+	try:
+		image.resource  # pylint: disable=pointless-statement
+	except wand.resource.DestroyedResourceError:
+		return False
+	return True
+
+class Arena:
+	def __init__(self):
+		self.images: List[wand.image.Image] = []
+		self.peak_bytes = memory_usage()
+		# forked processes (such as those of designs_db.encode_pool) inherit their parent's arena, but mustn't use it
+		self.pid = os.getpid()
+
+	def track(self, image):
+		self.images.append(image)
+		self.peak_bytes = max(self.peak_bytes, memory_usage())
+
+	def close(self) -> int:
+		"""Close every image that's still open, returning how many there were."""
+		self.peak_bytes = max(self.peak_bytes, memory_usage())
+		unclosed = 0
+		for image in self.images:
+			if is_open(image):
+				unclosed += 1
+				image.close()
+		self.images.clear()
+		return unclosed
+
+_local = threading.local()
+
+def current() -> Optional[Arena]:
+	arena_ = getattr(_local, 'arena', None)
+	if arena_ is None or arena_.pid != os.getpid():
+		return None
+	return arena_
+
+@contextlib.contextmanager
+def arena():
+	"""Close every image created in the body of the with statement, at the end of it, unless it's already closed."""
+	previous = getattr(_local, 'arena', None)
+	_local.arena = arena_ = Arena()
+	try:
+		yield arena_
+	finally:
+		_local.arena = previous
+		arena_.close()
+
+@contextlib.contextmanager
+def untracked():
+	"""Don't record the images created in the body of the with statement in any arena, so that they're kept open."""
+	previous = getattr(_local, 'arena', None)
+	_local.arena = None
+	try:
+		yield
+	finally:
+		_local.arena = previous
+
+def track_images(init):
+	@functools.wraps(init)
+	def wrapped(self, *args, **kwargs):
+		init(self, *args, **kwargs)
+		arena_ = current()
+		if arena_ is not None:
+			arena_.track(self)
+	return wrapped
+
+# clone() makes its copy with Image() too
+wand.image.Image.__init__ = track_images(wand.image.Image.__init__)
+apply_limits()
+
+def init_app(app):
+	app.before_request(open_request_arena)
+	app.after_request(close_request_arena_on_close)
+
+def open_request_arena():
+	# a previous request served by this thread may not have had a response to close its arena
+	previous = current()
+	if previous is not None:
+		previous.close()
+	_local.arena = request.image_arena = Arena()
+
+def close_request_arena_on_close(response):
+	arena_ = getattr(request, 'image_arena', None)
+	if arena_ is not None:
+		# the request context may be gone by the time the response has been sent
+		response.call_on_close(functools.partial(close_request_arena, arena_, request.endpoint))
+	return response
+
+def close_request_arena(arena_, endpoint):
+	if getattr(_local, 'arena', None) is arena_:
+		_local.arena = None
+	unclosed = arena_.close()
+	if unclosed:
+		UNCLOSED_IMAGES.inc(unclosed, endpoint=endpoint)
+	PEAK_BYTES.observe(arena_.peak_bytes, endpoint=endpoint)
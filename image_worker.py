@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+
+# Uploads the designs of images created with the job parameter. Run as many of these as you like.
+
+import time
+import traceback
+
+import image_arena
+from app import app
+from acnh.designs.db import claim_image_job, run_image_job
+
+# how long to wait before checking for new jobs when there are none
+POLL_INTERVAL = 1
+
+def main():
+	while True:
+		# new app context each time so that we don't hang onto expired API tokens
+		with app.app_context():
+			job = claim_image_job()
+			if job is not None:
+				print('Running job', job['job_id'], 'for image', job['image_id'])
+				try:
+					with image_arena.arena():
+						run_image_job(job)
+				except Exception:  # pylint: disable=broad-except
+					traceback.print_exc()
+				continue
+
+		time.sleep(POLL_INTERVAL)
+
+# the processes of designs_db.encode_pool import this module again, and mustn't run the loop
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,250 @@
+# © 2020 io mintz <io@mintz.cc>
+
+"""Timing histograms and counters, exposed in the Prometheus text format by /metrics.
+
+Each process keeps its own values. When metrics-dir is set, every process (every uWSGI worker, and every process
+of designs_db.encode_pool) periodically writes its values to a file in that directory, and /metrics adds up the files
+of all of them. When a process has exited, its values are added to exited.json and its file is deleted, so that counters
+never go backwards but the directory doesn't grow forever. Whether a process has exited is judged by its pid,
+so every process writing to metrics-dir must be in the same pid namespace (e.g. on the same machine).
+Without metrics-dir, /metrics only reports the process that serves it.
+"""
+
+import atexit
+import contextlib
+import fcntl
+import functools
+import json
+import os
+import secrets
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import disk_cache
+
+# seconds, like the Prometheus client libraries, plus a couple more for slow upstream requests
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+# how often each process writes its values to metrics-dir, at most
+FLUSH_INTERVAL = 5
+
+@dataclass(frozen=True)
+class Metric:
+	name: str
+	help: str
+	type: str
+	labels: Tuple[str, ...] = ()
+	buckets: Tuple[float, ...] = ()
+
+	def observe(self, value, **labels):
+		"""Record one observation of a histogram."""
+		values = _values(self, labels)
+		for i, bound in enumerate(self.buckets):
+			if value <= bound:
+				values[i] += 1
+		values[-2] += 1  # count, aka the +Inf bucket
+		values[-1] += value  # sum
+		_maybe_flush()
+
+	def inc(self, amount=1, **labels):
+		"""Increment a counter."""
+		_values(self, labels)[0] += amount
+		_maybe_flush()
+
+	@contextlib.contextmanager
+	def time(self, **labels):
+		"""Observe how many seconds the body of the with statement took, even if it raised."""
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe(time.perf_counter() - start, **labels)
+
+	def timed(self, func):
+		"""Decorate func so that each call to it is observed."""
+		@functools.wraps(func)
+		def wrapped(*args, **kwargs):
+			with self.time():
+				return func(*args, **kwargs)
+		return wrapped
+
+	def time_to_first_chunk(self, chunks, *, start=None, **labels) -> Iterator:
+		"""Yield chunks, observing how long it took to produce the first one.
+		start is a time.perf_counter() value to measure from instead of the first call to next().
+		"""
+		if start is None:
+			start = time.perf_counter()
+		chunks = iter(chunks)
+		try:
+			first = next(chunks)
+		except StopIteration:
+			self.observe(time.perf_counter() - start, **labels)
+			return
+		self.observe(time.perf_counter() - start, **labels)
+		yield first
+		yield from chunks
+
+metrics: Dict[str, Metric] = {}
+
+def histogram(name, help, labels=(), buckets=DEFAULT_BUCKETS) -> Metric:  # pylint: disable=redefined-builtin
+	metric = metrics[name] = Metric(name, help, 'histogram', tuple(labels), tuple(buckets))
+	return metric
+
+def counter(name, help, labels=()) -> Metric:  # pylint: disable=redefined-builtin
+	metric = metrics[name] = Metric(name, help, 'counter', tuple(labels))
+	return metric
+
+# the values of this process, by metric name, then by label values encoded as JSON
+_process_values: Dict[str, Dict[str, List[float]]] = {}
+_pid = None
+_last_flush = 0.0
+_path: Optional[Path] = None
+
+def _values(metric: Metric, labels) -> List[float]:
+	if labels.keys() != set(metric.labels):
+		raise TypeError(f'{metric.name} takes the labels {", ".join(metric.labels) or "(none)"}')
+	_check_pid()
+	by_labels = _process_values.setdefault(metric.name, {})
+	key = json.dumps([str(labels[label]) for label in metric.labels])
+	with contextlib.suppress(KeyError):
+		return by_labels[key]
+	# one count per bucket, then the total count and the sum
+	values = by_labels[key] = [0] * (len(metric.buckets) + 2) if metric.type == 'histogram' else [0]
+	return values
+
+def _check_pid():
+	"""Start afresh in forked processes, since their parent will report what they inherited."""
+	global _pid, _path, _last_flush  # pylint: disable=global-statement
+	if _pid == os.getpid():
+		return
+	_pid = os.getpid()
+	_process_values.clear()
+	_last_flush = time.monotonic()
+	directory = metrics_dir()
+	# not just the pid, since pids are reused
+	_path = None if directory is None else directory / f'{_pid}-{secrets.token_hex(4)}.json'
+
+def metrics_dir() -> Optional[Path]:
+	from utils import config  # resolve circular import
+	path = config.get('metrics-dir')
+	return None if path is None else Path(path)
+
+def _maybe_flush():
+	if _path is not None and time.monotonic() - _last_flush >= FLUSH_INTERVAL:
+		flush()
+
+def flush():
+	"""Write the values of this process to metrics-dir, if it's set."""
+	global _last_flush  # pylint: disable=global-statement
+	_check_pid()
+	if _path is None:
+		return
+	_last_flush = time.monotonic()
+	disk_cache.write(_path.parent, _path.name, json.dumps(_process_values).encode())
+
+atexit.register(flush)
+
+# the values of every process that has exited, added together
+EXITED_FILE = 'exited.json'
+# held while merging the files of exited processes, so that no file is added twice
+MERGE_LOCK_FILE = 'merge.lock'
+
+def collect() -> Dict[str, Dict[str, List[float]]]:
+	"""Return the values of every process, added together."""
+	directory = metrics_dir()
+	if directory is None:
+		return _process_values
+
+	flush()
+	merged = merge_exited(directory)
+	totals = {}
+	for path in directory.glob('*.json'):
+		if path.name in merged:
+			continue
+		try:
+			process_values = json.loads(path.read_bytes())
+		except FileNotFoundError:
+			continue
+		add_values(totals, process_values['values'] if path.name == EXITED_FILE else process_values)
+	return totals
+
+def add_values(totals, process_values):
+	for name, by_labels in process_values.items():
+		for key, values in by_labels.items():
+			total = totals.setdefault(name, {}).setdefault(key, [0] * len(values))
+			for i, value in enumerate(values):
+				total[i] += value
+
+def has_exited(path: Path) -> bool:
+	"""Return whether the process which wrote the given file has exited."""
+	pid = int(path.name.partition('-')[0])
+	if pid == os.getpid():
+		return False
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return True
+	except PermissionError:
+		# it exists, but belongs to someone else
+		return False
+	return False
+
+def merge_exited(directory: Path) -> Set[str]:
+	"""Add the values of processes which have exited to EXITED_FILE, and delete their files.
+
+	Return the names of files which have been added to EXITED_FILE, but which may not have been deleted yet.
+	"""
+	with open(directory / MERGE_LOCK_FILE, 'a') as lock:
+		fcntl.flock(lock, fcntl.LOCK_EX)
+		exited_path = directory / EXITED_FILE
+		try:
+			exited = json.loads(exited_path.read_bytes())
+		except FileNotFoundError:
+			exited = {'values': {}, 'merged': []}
+
+		# names of files which have been added already, in case deleting them failed
+		merged = set(exited['merged'])
+		paths = [path for path in directory.glob('*-*.json') if has_exited(path)]
+		new_paths = [path for path in paths if path.name not in merged]
+		if new_paths:
+			for path in new_paths:
+				add_values(exited['values'], json.loads(path.read_bytes()))
+				merged.add(path.name)
+			# forget the names of files that are gone for good, so that this list doesn't grow forever either
+			exited['merged'] = sorted(name for name in merged if (directory / name).exists())
+			disk_cache.write(directory, EXITED_FILE, json.dumps(exited).encode())
+
+		for path in paths:
+			with contextlib.suppress(FileNotFoundError):
+				path.unlink()
+		return merged
+
+def exposition() -> str:
+	"""Return every metric in the Prometheus text format."""
+	totals = collect()
+	lines = []
+	for metric in metrics.values():
+		lines.append(f'# HELP {metric.name} {metric.help}')
+		lines.append(f'# TYPE {metric.name} {metric.type}')
+		for key, values in totals.get(metric.name, {}).items():
+			labels = dict(zip(metric.labels, json.loads(key)))
+			if metric.type == 'counter':
+				lines.append(sample(metric.name, labels, values[0]))
+				continue
+
+			for bound, count in zip(metric.buckets, values):
+				lines.append(sample(metric.name + '_bucket', {**labels, 'le': str(bound)}, count))
+			lines.append(sample(metric.name + '_bucket', {**labels, 'le': '+Inf'}, values[-2]))
+			lines.append(sample(metric.name + '_count', labels, values[-2]))
+			lines.append(sample(metric.name + '_sum', labels, values[-1]))
+	return '\n'.join(lines) + '\n'
+
+def sample(name, labels, value) -> str:
+	if not labels:
+		return f'{name} {value}'
+	formatted_labels = ','.join(f'{label}="{escape_label_value(label_value)}"' for label, label_value in labels.items())
+	return f'{name}{{{formatted_labels}}} {value}'
+
+def escape_label_value(value):
+	return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
@@ -0,0 +1,130 @@
+# © 2020 io mintz <io@mintz.cc>
+
+"""A size bounded on-disk cache of rendered image and design pages.
+
+Those pages depend only on data that rarely changes, apart from a few fragments which depend on who's viewing them
+(flashed messages, and the delete form with its CSRF token). Templates include such fragments with fragment(),
+which leaves a marker in cached pages that is filled in on every request, so that a repeat view costs one file read.
+
+Entries are keyed by image ID or design ID and by a hash of the templates, so editing a template invalidates
+every page. They're deleted when the image or design they show changes (see acnh/designs/db.py), and are
+in any case only served for page-cache-max-age seconds, since designs from other creators can be deleted upstream
+without our knowledge. The cache is disabled unless page-cache-dir is set.
+"""
+
+import functools
+import hashlib
+import json
+import re
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, NamedTuple, Optional, Union
+
+import jinja2
+from flask import current_app, render_template, Response
+from markupsafe import Markup
+
+import disk_cache
+import utils
+from utils import config
+
+DEFAULT_MAX_SIZE = 64 * 1024 ** 2
+DEFAULT_MAX_AGE = 24 * 60 * 60
+
+FRAGMENT_MARKER = '<!-- fragment: {} -->'
+FRAGMENT_MARKER_RE = re.compile(r'<!-- fragment: ([\w.-]+) -->')
+
+class Page(NamedTuple):
+	template_name: str
+	context: Dict[str, Any]
+	# the variables that fragments of this page need, which are cached along with it. Must be JSON serializable.
+	fragment_context: Optional[Dict[str, Any]] = None
+	# false for pages which are about to change, such as those of images whose designs are still being uploaded
+	cacheable: bool = True
+
+def cache_dir() -> Optional[Path]:
+	path = config.get('page-cache-dir')
+	return None if path is None else Path(path)
+
+def enabled() -> bool:
+	return cache_dir() is not None
+
+@functools.lru_cache(maxsize=None)
+def template_version() -> str:
+	"""Return a hash of every template, so that pages rendered by older templates are never served."""
+	h = hashlib.sha256()
+	for path in sorted(Path(current_app.root_path, current_app.template_folder).rglob('*.html')):
+		h.update(path.name.encode() + b'\0' + path.read_bytes())
+	return h.hexdigest()[:16]
+
+def image_key(image_id) -> str:
+	return f'image-{image_id}'
+
+def design_key(design_id) -> str:
+	return f'design-{design_id}'
+
+def filename(key) -> str:
+	return f'{key}-{template_version()}.json'
+
+@jinja2.contextfunction
+def fragment(context, template_name):
+	"""Include template_name, or, while a page is being rendered for the cache, leave a marker in its place."""
+	if context.get('deferring_fragments'):
+		return Markup(FRAGMENT_MARKER.format(template_name))
+	return Markup(render_template(template_name, **context.get_all()))
+
+def page(key, make_page: Callable[[], Union[Page, Response]]) -> Response:
+	"""Serve the page for key from the cache if possible. Otherwise render the Page returned by make_page
+	and cache it, if it's cacheable. make_page may also return a Response, which is served as is and not cached.
+	"""
+	entry = lookup(key) if enabled() else None
+	if entry is None:
+		rv = make_page()
+		if not isinstance(rv, Page):
+			return rv
+		if not enabled() or not rv.cacheable:
+			return utils.stream_template(rv.template_name, **rv.context)
+		entry = store(key, rv)
+
+	return current_app.response_class(fill_fragments(entry))
+
+def lookup(key) -> Optional[dict]:
+	path = disk_cache.lookup(cache_dir(), filename(key))
+	if path is None:
+		return None
+	try:
+		entry = json.loads(path.read_bytes())
+	except FileNotFoundError:
+		# evicted in the meantime
+		return None
+	if time.time() - entry['created_at'] > config.get('page-cache-max-age', DEFAULT_MAX_AGE):
+		return None
+	return entry
+
+def store(key, page: Page) -> dict:  # pylint: disable=redefined-outer-name
+	entry = {
+		'created_at': time.time(),
+		'body': render_template(page.template_name, **page.context, deferring_fragments=True),
+		'fragment_context': {} if page.fragment_context is None else page.fragment_context,
+	}
+	disk_cache.write(cache_dir(), filename(key), json.dumps(entry).encode())
+	disk_cache.evict(cache_dir(), config.get('page-cache-max-size', DEFAULT_MAX_SIZE))
+	return entry
+
+def fill_fragments(entry) -> str:
+	return FRAGMENT_MARKER_RE.sub(
+		lambda m: render_template(m[1], **entry['fragment_context']),
+		entry['body'],
+	)
+
+def forget(key):
+	"""Delete every cached version of the page for key."""
+	if enabled():
+		disk_cache.forget(cache_dir(), f'{key}-*')
+
+def forget_image(image_id):
+	forget(image_key(image_id))
+
+def forget_designs(design_ids):
+	for design_id in design_ids:
+		forget(design_key(design_id))
@@ -0,0 +1,103 @@
+# © 2020 io mintz <io@mintz.cc>
+
+"""Opt-in profiling of individual requests, for finding out why a request is slow in production.
+
+A request is profiled when profile-dir and profiler-token are set and the request has the header
+"X-Profile: <profiler-token>". cProfile then runs from the start of the request until its response has been sent,
+including any body that is streamed after the view returns. The ID of the profile is sent in the X-Profile-Id header.
+Work done in other processes, such as the layers rendered by designs_db.encode_pool, is not included.
+
+Each profile is saved to profile-dir as <id>.prof, in the format read by pstats (and so by snakeviz, flameprof etc.),
+next to <id>.json, which describes the request. The least recently saved profiles are deleted
+once the directory holds more than profile-max-size bytes.
+"""
+
+import contextlib
+import cProfile
+import json
+import marshal
+import pstats
+import secrets
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from flask import request
+
+import disk_cache
+from utils import config
+
+DEFAULT_MAX_SIZE = 256 * 1024 ** 2
+REQUEST_HEADER = 'X-Profile'
+RESPONSE_HEADER = 'X-Profile-Id'
+
+def init_app(app):
+	# before every other before_request function, so that they're profiled too
+	app.before_request_funcs.setdefault(None, []).insert(0, start)
+	app.after_request(finish_on_close)
+
+def profile_dir() -> Optional[Path]:
+	path = config.get('profile-dir')
+	return None if path is None else Path(path)
+
+def enabled() -> bool:
+	return profile_dir() is not None and bool(config.get('profiler-token'))
+
+def wanted() -> bool:
+	return enabled() and secrets.compare_digest(request.headers.get(REQUEST_HEADER, ''), config['profiler-token'])
+
+def start():
+	request.profile = None
+	if not wanted():
+		return
+
+	profile = cProfile.Profile()
+	request.profile = profile
+	# the request context may be gone by the time the response has been sent, so note everything now
+	profile.info = {
+		'id': secrets.token_hex(8),
+		'method': request.method,
+		'path': request.full_path.rstrip('?'),
+		'endpoint': request.endpoint,
+		'started_at': time.time(),
+	}
+	profile.started_at = time.perf_counter()
+	profile.enable()
+
+def finish_on_close(response):
+	profile = getattr(request, 'profile', None)
+	if profile is None:
+		return response
+
+	response.headers[RESPONSE_HEADER] = profile.info['id']
+	response.call_on_close(lambda: finish(profile, response.status_code))
+	return response
+
+def finish(profile, status):
+	profile.disable()
+	info = {**profile.info, 'status': status, 'seconds': time.perf_counter() - profile.started_at}
+	directory = profile_dir()
+	# the .prof file comes first so that every profile in the index can be downloaded
+	disk_cache.write(directory, info['id'] + '.prof', marshal.dumps(pstats.Stats(profile).stats))
+	disk_cache.write(directory, info['id'] + '.json', json.dumps(info).encode())
+	disk_cache.evict(directory, config.get('profile-max-size', DEFAULT_MAX_SIZE))
+
+def index() -> List[dict]:
+	"""Return a description of every saved profile, newest first."""
+	directory = profile_dir()
+	infos = []
+	for path in directory.glob('*.json'):
+		with contextlib.suppress(FileNotFoundError):
+			info = json.loads(path.read_bytes())
+			# the profile itself may have been evicted first
+			if path.with_suffix('.prof').exists():
+				infos.append(info)
+	infos.sort(key=lambda info: info['started_at'], reverse=True)
+	return infos
+
+def path(profile_id) -> Optional[Path]:
+	"""Return the path of the .prof file of the given profile, or None if there isn't one."""
+	if not all(c in '0123456789abcdef' for c in profile_id):
+		return None
+	p = profile_dir() / f'{profile_id}.prof'
+	return p if p.exists() else None
@@ -28,6 +28,9 @@ LIMIT $1
 SELECT image_id, designs_required, images.pro
 FROM designs INNER JOIN images USING (image_id)
 WHERE design_id = $1
+-- identical images share designs, so pick the first one to use it
+ORDER BY image_id
+LIMIT 1
 -- :endmacro
 
 -- :macro delete_design()
@@ -38,15 +41,140 @@ WHERE design_id = $1
 
 -- :macro delete_designs()
 -- params: design_ids
+WITH forgotten AS (
+	DELETE FROM design_accesses
+	WHERE design_id = ANY ($1)
+)
 DELETE FROM designs
 WHERE design_id = ANY ($1)
+RETURNING image_id
+-- :endmacro
+
+-- :macro design_slots_used()
+-- params: pro, shard
+SELECT count(DISTINCT design_id)
+FROM designs
+WHERE pro = $1 AND shard = $2
+-- :endmacro
+
+-- :macro design_slots_used_by_shard()
+-- params: pro
+SELECT shard, count(DISTINCT design_id)
+FROM designs
+WHERE pro = $1
+GROUP BY shard
+-- :endmacro
+
+-- :macro image_shard()
+-- params: image_id
+-- images placed before images.shard existed only have it recorded on their designs
+SELECT coalesce(shard, (SELECT shard FROM designs WHERE designs.image_id = images.image_id LIMIT 1))
+FROM images
+WHERE image_id = $1
+-- :endmacro
+
+-- :macro set_image_shard()
+-- params: image_id, shard
+-- keeps the existing shard if another upload placed the image first
+UPDATE images
+SET shard = coalesce(shard, $2)
+WHERE image_id = $1
+RETURNING shard
+-- :endmacro
+
+-- :macro eviction_candidates(policy)
+-- params: pro, shard, limit
+-- each branch must sort the same way as the corresponding policy in acnh/designs/eviction.py
+SELECT design_id
+FROM designs d
+LEFT JOIN design_accesses a USING (design_id)
+WHERE
+	pro = $1
+	AND shard = $2
+	-- designs can be shared by several images, so only consider the row for the first image to use each one
+	AND d.created_at = (SELECT min(created_at) FROM designs WHERE design_id = d.design_id)
+-- :if policy == 'lru'
+ORDER BY coalesce(a.last_accessed_at, d.created_at)
+-- :elif policy == 'lfu'
+ORDER BY coalesce(a.access_count, 0), coalesce(a.last_accessed_at, d.created_at)
+-- :else
+ORDER BY d.created_at
+-- :endif
+LIMIT $3
+FOR UPDATE OF d SKIP LOCKED
+-- :endmacro
+
+-- :macro record_image_access()
+-- params: image_id
+INSERT INTO design_accesses (design_id)
+SELECT DISTINCT design_id
+FROM designs
+WHERE image_id = $1
+ON CONFLICT (design_id) DO UPDATE SET
+	last_accessed_at = excluded.last_accessed_at,
+	access_count = design_accesses.access_count + 1
+-- :endmacro
+
+-- :macro record_design_access()
+-- params: design_id
+INSERT INTO design_accesses (design_id)
+SELECT $1
+WHERE EXISTS (SELECT 1 FROM designs WHERE design_id = $1)
+ON CONFLICT (design_id) DO UPDATE SET
+	last_accessed_at = excluded.last_accessed_at,
+	access_count = design_accesses.access_count + 1
+-- :endmacro
+
+-- :macro forget_design_accesses()
+-- params: design_ids
+DELETE FROM design_accesses
+WHERE design_id = ANY ($1)
+-- :endmacro
+
+-- :macro log_image_access()
+-- params: image_id
+INSERT INTO image_access_log (image_id, designs_required, pro)
+SELECT image_id, designs_required, pro
+FROM images
+WHERE image_id = $1
+-- :endmacro
+
+-- :macro image_access_log()
+SELECT image_id, designs_required, pro, accessed_at
+FROM image_access_log
+ORDER BY accessed_at
+-- :endmacro
+
+-- :macro pool_design_ids()
+-- params: pro, shard
+SELECT DISTINCT design_id
+FROM designs
+WHERE pro = $1 AND shard = $2
+-- :endmacro
+
+-- :macro live_design_by_digest()
+-- params: digest, pro, shard
+SELECT design_id
+FROM designs
+WHERE digest = $1 AND pro = $2 AND shard = $3
+-- the same row that eviction_candidates would lock, so that we wait for any GC of this design to finish
+ORDER BY created_at
+LIMIT 1
+FOR SHARE
+-- :endmacro
+
+-- :macro unreferenced_designs()
+-- params: design_ids
+SELECT unnest($1::BIGINT[])
+EXCEPT
+SELECT design_id FROM designs
 -- :endmacro
 
 -- :macro delete_image_designs()
 -- params: image_id
 DELETE FROM designs
 WHERE image_id = $1
-RETURNING design_id
+RETURNING design_id, shard
 -- :endmacro
 
 -- :macro image_author_id()
@@ -69,9 +197,9 @@ RETURNING image_id
 -- :endmacro
 
 -- :macro create_design()
--- params: image_id, design_id, position, pro
-INSERT INTO designs (image_id, design_id, position, pro)
-VALUES ($1, $2, $3, $4)
+-- params: image_id, design_id, position, pro, digest, shard
+INSERT INTO designs (image_id, design_id, position, pro, digest, shard)
+VALUES ($1, $2, $3, $4, $5, $6)
 RETURNING design_id
 -- :endmacro
 
@@ -82,7 +210,7 @@ FROM images
 WHERE image_id = $1
 -- :endmacro
 
--- :macro image_with_designs()
+-- :macro image_with_designs(layers=true)
 -- params: image_id
 SELECT
 	image_id,
@@ -93,12 +221,15 @@ SELECT
 	width,
 	height,
 	mode,
+-- :if layers
 	layers,
+-- :endif
 	images.pro,
 	designs_required,
 	type_code,
 	design_id,
-	position
+	position,
+	images.shard
 FROM
 	images
 	LEFT JOIN designs USING (image_id)
@@ -106,6 +237,13 @@ WHERE image_id = $1
 ORDER BY position
 -- :endmacro
 
+-- :macro image_layers()
+-- params: image_id
+SELECT layers
+FROM images
+WHERE image_id = $1
+-- :endmacro
+
 -- :macro image_designs()
 -- params: image_id
 SELECT *
@@ -114,8 +252,108 @@ WHERE image_id = $1
 ORDER BY position
 -- :endmacro
 
+-- :macro design_payloads()
+-- params: image_id, format_version
+SELECT position, was_quantized, meta, body, net_image
+FROM design_payloads
+WHERE image_id = $1 AND format_version = $2
+-- :endmacro
+
+-- :macro save_design_payload()
+-- params: image_id, position, format_version, was_quantized, meta, body, net_image
+INSERT INTO design_payloads (image_id, position, format_version, was_quantized, meta, body, net_image)
+VALUES ($1, $2, $3, $4, $5, $6, $7)
+ON CONFLICT (image_id, position) DO UPDATE SET
+	format_version = EXCLUDED.format_version,
+	was_quantized = EXCLUDED.was_quantized,
+	meta = EXCLUDED.meta,
+	body = EXCLUDED.body,
+	net_image = EXCLUDED.net_image
+-- :endmacro
+
+-- :macro image_previews()
+-- params: image_id
+SELECT net_image, layers
+FROM image_previews
+WHERE image_id = $1
+-- :endmacro
+
+-- :macro save_image_previews()
+-- params: image_id, net_image, layers
+INSERT INTO image_previews (image_id, net_image, layers)
+VALUES ($1, $2, $3)
+ON CONFLICT (image_id) DO UPDATE SET
+	net_image = EXCLUDED.net_image,
+	layers = EXCLUDED.layers
+-- :endmacro
+
+-- :macro images_without_previews()
+SELECT image_id
+FROM images LEFT JOIN image_previews USING (image_id)
+WHERE image_previews.image_id IS NULL
+ORDER BY image_id
+-- :endmacro
+
 -- #endregion Designs
 
+-- #region Image jobs
+
+-- :macro enqueue_image_job()
+-- params: image_id, options
+INSERT INTO image_jobs (image_id, options)
+VALUES ($1, $2::jsonb)
+RETURNING job_id
+-- :endmacro
+
+-- :macro claim_image_job()
+-- params: timeout
+UPDATE image_jobs
+SET status = 'running', started_at = CURRENT_TIMESTAMP, attempts = attempts + 1
+WHERE job_id = (
+	SELECT job_id
+	FROM image_jobs
+	WHERE
+		status = 'queued'
+		-- the worker running this job probably died
+		OR (status = 'running' AND started_at < CURRENT_TIMESTAMP - $1::interval)
+	ORDER BY job_id
+	FOR UPDATE SKIP LOCKED
+	LIMIT 1
+)
+RETURNING job_id, image_id, attempts, options::text
+-- :endmacro
+
+-- :macro finish_image_job()
+-- params: job_id
+UPDATE image_jobs
+SET status = 'done', finished_at = CURRENT_TIMESTAMP
+WHERE job_id = $1
+-- :endmacro
+
+-- :macro fail_image_job()
+-- params: job_id, error
+UPDATE image_jobs
+SET status = 'failed', finished_at = CURRENT_TIMESTAMP, error = $2::jsonb
+WHERE job_id = $1
+-- :endmacro
+
+-- :macro image_job()
+-- params: job_id
+SELECT job_id, image_id, status, created_at, started_at, finished_at, error::text
+FROM image_jobs
+WHERE job_id = $1
+-- :endmacro
+
+-- :macro image_job_results()
+-- params: image_id
+SELECT design_id, position, was_quantized
+FROM designs LEFT JOIN design_payloads USING (image_id, position)
+WHERE image_id = $1
+ORDER BY designs.created_at, position DESC
+-- :endmacro
+
+-- #endregion Image jobs
+
 -- #region Authorization
 
 -- :macro secret()
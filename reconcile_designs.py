@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+
+# Run this periodically (e.g. from cron or a uWSGI cron/timer) to keep the local design slot ledger
+# in sync with the designs that actually exist in the creator account.
+
+from app import app
+from acnh.common import shards
+from acnh.designs.db import reconcile_designs
+
+with app.app_context():
+	for shard in shards():
+		for pro in False, True:
+			forgotten, orphaned = reconcile_designs(pro=pro, shard=shard)
+			pool = 'pro' if pro else 'basic'
+			print(
+				f'shard {shard} {pool}: forgot {len(forgotten)} missing designs,',
+				f'deleted {len(orphaned)} orphaned designs',
+			)
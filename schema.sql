@@ -27,6 +27,9 @@ CREATE TABLE images (
 	) STORED,
 
 	type_code SMALLINT NOT NULL,
+	-- which uploader account this image's designs are uploaded to (see designs.shard), once it has been chosen.
+	-- Kept even after every design has been evicted, so that refreshes go back to the same account.
+	shard SMALLINT,
 
 	CHECK (
 		(pro AND width IS NULL AND height IS NULL AND mode IS NULL)
@@ -37,17 +40,85 @@ CREATE TABLE images (
 CREATE INDEX latest_images ON images (created_at DESC);
 
 -- a design is a single small image uploaded to ACNH servers.
+-- Identical images share designs, so the same design_id can appear in several rows.
 CREATE TABLE designs (
-	design_id BIGINT NOT NULL PRIMARY KEY,
+	design_id BIGINT NOT NULL,
 	-- no ON DELETE CASCADE because these should be deleted
 	image_id INTEGER NOT NULL REFERENCES images,
 	-- what position is it in in the original image?
 	position SMALLINT NOT NULL,
 	created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-	pro BOOLEAN NOT NULL
+	pro BOOLEAN NOT NULL,
+	-- encode.content_digest() of the uploaded body
+	digest BYTEA,
+	-- which uploader account this design is in. 0 is the top level account in config.toml,
+	-- and n is the nth entry of uploader-accounts.
+	shard SMALLINT NOT NULL DEFAULT 0,
+
+	PRIMARY KEY (image_id, position)
 );
 
-CREATE INDEX design_sequence_idx ON designs (image_id, position);
+CREATE INDEX design_id_idx ON designs (design_id);
+CREATE INDEX design_digest_idx ON designs (digest);
 -- lets us find which ones to garbage collect
-CREATE INDEX oldest_designs ON designs (pro, created_at);
+CREATE INDEX oldest_designs ON designs (shard, pro, created_at);
+
+-- how often and how recently each design in the pool has been looked at, for access aware eviction policies.
+-- Keyed by design_id rather than (image_id, position) since identical images share designs.
+CREATE TABLE design_accesses (
+	design_id BIGINT PRIMARY KEY,
+	last_accessed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+	access_count INTEGER NOT NULL DEFAULT 1
+);
+
+-- every upload and view of an image, for simulate_eviction.py. Only written if log-image-accesses is enabled.
+-- No foreign key so that deleted images stay in the log.
+CREATE TABLE image_access_log (
+	image_id INTEGER NOT NULL,
+	designs_required SMALLINT NOT NULL,
+	pro BOOLEAN NOT NULL,
+	accessed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+
+-- the exact payload sent to the API for each design of an image, so that garbage collected designs
+-- can be uploaded again without re-encoding anything
+CREATE TABLE design_payloads (
+	image_id INTEGER NOT NULL REFERENCES images ON DELETE CASCADE,
+	position SMALLINT NOT NULL,
+	-- encode.FORMAT_VERSION at the time this was encoded. Stale payloads are re-encoded on refresh.
+	format_version SMALLINT NOT NULL,
+	was_quantized BOOLEAN NOT NULL,
+	meta BYTEA NOT NULL,
+	body BYTEA NOT NULL,
+	net_image BYTEA NOT NULL,
+
+	PRIMARY KEY (image_id, position)
+);
+
+-- PNGs rendered once when an image is created, so that viewing it doesn't have to render anything
+CREATE TABLE image_previews (
+	image_id INTEGER PRIMARY KEY REFERENCES images ON DELETE CASCADE,
+	net_image BYTEA NOT NULL,
+	-- as displayed on the image page, in external layer order
+	layers BYTEA[] NOT NULL
+);
+
+CREATE TYPE image_job_status AS ENUM ('queued', 'running', 'done', 'failed');
+
+-- images whose designs are waiting to be uploaded by image_worker.py
+CREATE TABLE image_jobs (
+	job_id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+	image_id INTEGER NOT NULL REFERENCES images ON DELETE CASCADE,
+	status image_job_status NOT NULL DEFAULT 'queued',
+	attempts SMALLINT NOT NULL DEFAULT 0,
+	-- extra keyword arguments for db.upload_basic_design
+	options JSONB NOT NULL DEFAULT '{}',
+	created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+	started_at TIMESTAMP WITH TIME ZONE,
+	finished_at TIMESTAMP WITH TIME ZONE,
+	-- the ACNHError.to_dict() of whatever made the job fail
+	error JSONB
+);
 
+CREATE INDEX pending_image_jobs ON image_jobs (job_id) WHERE status IN ('queued', 'running');
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+
+# Replay the image access log against each eviction policy, to compare how often each one would have
+# made people refresh images. Requires log-image-accesses to have been enabled for a while.
+# Usage: ./simulate_eviction.py [slots per pool]
+
+import sys
+
+from app import app
+from acnh.designs import eviction
+from acnh.designs.api import MAX_DESIGNS
+from utils import pg, queries
+
+slots = int(sys.argv[1]) if len(sys.argv) > 1 else MAX_DESIGNS
+
+with app.app_context():
+	log = pg().fetch(queries.image_access_log())
+
+for pro in False, True:
+	events = [
+		(row['image_id'], row['designs_required'], row['accessed_at'].timestamp())
+		for row in log
+		if row['pro'] == pro
+	]
+	print('pro' if pro else 'basic', f'({len(events)} events, {slots} slots):')
+	for policy_name in eviction.POLICIES:
+		result = eviction.simulate(events, policy_name, slots=slots)
+		print(
+			f'\t{policy_name}: {result.refreshes}/{result.accesses} accesses refreshed ({result.refresh_rate:.1%}),',
+			f'{result.uploads} uploads, {result.evictions} evictions',
+		)
@@ -29,14 +29,77 @@ const enableForm = () => {
 	submitElSpinner.classList.add('hidden');
 }
 
-formEl.addEventListener('submit', (e) => {
-	clearError();
+const addResult = (wasQuantized, designCode) => {
+	let row = document.createElement('li');
+	if (wasQuantized) {
+		let emojiSpan = document.createElement('span');
+		emojiSpan.classList.add('emoji');
+		emojiSpan.innerText = '⚠️';
+		emojiSpan.title = quantizedMessage;
+		row.appendChild(emojiSpan);
+	}
 
-	resultsEl.classList.remove('hidden');
-	resultsEl.removeAttribute('aria-hidden');
-	submitEl.setAttribute('disabled', '');
-	submitElSpinner.classList.remove('hidden');
+	row.appendChild(document.createTextNode(' MO-' + designCode));
+	resultsListEl.appendChild(row);
+}
+
+const showDone = imageId => {
+	let doneEl = document.createElement('div');
+	// i know innerHtml is bad but otherwise this would be so tedious
+	doneEl.innerHTML = `
+		<h2>Done</h2>
+		<p>
+			<span class=emoji>✅</span>️ <a href="/image/${imageId}">View your created design</a>
+		</p>
+	`;
+	resultsEl.appendChild(doneEl);
+	submitElSpinner.classList.add('hidden');
+}
 
+const sleep = ms => new Promise(resolve => setTimeout(resolve, ms));
+
+// upload the image to be processed in the background, and poll for the results
+const createImageJob = async formData => {
+	formData.append('job', '1');
+	let resp = await fetch('/api/v0/images', {
+		method: 'POST',
+		body: formData,
+	});
+	let created = await resp.json();
+	if (created.error_code !== undefined) {
+		setError(created);
+		return;
+	}
+
+	let seen = 0;
+	while (true) {
+		let job = await (await fetch(`/api/v0/image-jobs/${created.job_id}`)).json();
+		if (job.error_code !== undefined) {
+			setError(job);
+			return;
+		}
+
+		for (let result of job.results.slice(seen)) {
+			addResult(result.was_quantized, result.design_code);
+		}
+		seen = job.results.length;
+
+		if (job.status === 'failed') {
+			setError(job.error);
+			enableForm();
+			return;
+		}
+		if (job.status === 'done') {
+			break;
+		}
+
+		await sleep(1000);
+	}
+
+	showDone(created.image_id);
+}
+
+const createImage = async formData => {
 	const maybeError = row => {
 		if (row.startsWith('error: ')) {
 			return JSON.parse(row.substr('error: '.length));
@@ -44,54 +107,44 @@ formEl.addEventListener('submit', (e) => {
 		return null;
 	}
 
-	let formData = new FormData(formEl);
-	(async () => {
-		let resp = await fetch('/api/v0/images', {
-			method: 'POST',
-			body: formData,
-		});
-		let it = streamLines(resp.body);
-		let err;
-		let firstRow = (await it.next()).value;
-		if ((err = maybeError(firstRow)) !== null) {
+	let resp = await fetch('/api/v0/images', {
+		method: 'POST',
+		body: formData,
+	});
+	let it = streamLines(resp.body);
+	let err;
+	let firstRow = (await it.next()).value;
+	if ((err = maybeError(firstRow)) !== null) {
+		setError(err);
+		return;
+	}
+	let imageId = firstRow;
+	for await (let line of it) {
+		if (!line) { continue; }
+		console.log(line);
+		if ((err = maybeError(line)) !== null) {
 			setError(err);
+			enableForm();
 			return;
 		}
-		let imageId = firstRow;
-		for await (let line of it) {
-			if (!line) { continue; }
-			console.log(line);
-			if ((err = maybeError(line)) !== null) {
-				setError(err);
-				enableForm();
-				return;
-			}
-
-			let [wasQuantized, designCode] = line.split(',');
-			let row = document.createElement('li');
-			if (parseInt(wasQuantized)) {
-				let emojiSpan = document.createElement('span');
-				emojiSpan.classList.add('emoji');
-				emojiSpan.innerText = '⚠️';
-				emojiSpan.title = quantizedMessage;
-				row.appendChild(emojiSpan);
-			}
-
-			row.appendChild(document.createTextNode(' MO-' + designCode));
-			resultsListEl.appendChild(row);
-		}
 
-		let doneEl = document.createElement('div');
-		// i know innerHtml is bad but otherwise this would be so tedious
-		doneEl.innerHTML = `
-			<h2>Done</h2>
-			<p>
-				<span class=emoji>✅</span>️ <a href="/image/${imageId}">View your created design</a>
-			</p>
-		`;
-		resultsEl.appendChild(doneEl);
-		submitElSpinner.classList.add('hidden');
-	})();
+		let [wasQuantized, designCode] = line.split(',');
+		addResult(parseInt(wasQuantized), designCode);
+	}
+
+	showDone(imageId);
+}
+
+formEl.addEventListener('submit', (e) => {
+	clearError();
+
+	resultsEl.classList.remove('hidden');
+	resultsEl.removeAttribute('aria-hidden');
+	submitEl.setAttribute('disabled', '');
+	submitElSpinner.classList.remove('hidden');
+
+	let formData = new FormData(formEl);
+	(imageJobs ? createImageJob : createImage)(formData);
 	// do this last so that if anything fails along the way (e.g. on an old browser) the
 	// normal submit form still works
 	e.preventDefault();
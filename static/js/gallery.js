@@ -0,0 +1,63 @@
+let galleryEl = document.getElementById('gallery');
+let moreEl = document.getElementById('gallery-more');
+
+const designLink = design => {
+	let linkEl = document.createElement('a');
+	linkEl.title = design.name;
+	linkEl.href = `/design/${design.design_code}`;
+	let imgEl = document.createElement('img');
+	imgEl.alt = design.name;
+	imgEl.loading = 'lazy';
+	imgEl.src = `/design/${design.design_code}/thumbnail.png`;
+	linkEl.appendChild(imgEl);
+	return linkEl;
+}
+
+let loading = false;
+
+const loadMore = async () => {
+	if (loading) {
+		return;
+	}
+	loading = true;
+
+	let { url, offset, limit } = moreEl.dataset;
+	let resp = await fetch(`${url}&offset=${offset}&limit=${limit}`, { headers: { Accept: 'application/json' } });
+	let isJson = (resp.headers.get('Content-Type') || '').startsWith('application/json');
+	let page = isJson ? await resp.json() : null;
+	if (!resp.ok || !isJson) {
+		moreEl.classList.add('bg-danger');
+		if (page && page.error) {
+			moreEl.innerText = `${page.error} (error code: ${page.error_code})`;
+		} else if (page && page.http_status_name) {
+			moreEl.innerText = `${page.http_status_name}: ${page.http_status_description}`;
+		} else {
+			moreEl.innerText = `Couldn't load more designs (HTTP ${resp.status}).`;
+		}
+		observer.disconnect();
+		return;
+	}
+
+	for (let design of page.designs) {
+		galleryEl.appendChild(designLink(design));
+	}
+
+	if (page.next_offset === null) {
+		observer.disconnect();
+		moreEl.remove();
+	} else {
+		moreEl.dataset.offset = page.next_offset;
+		// observe it again so that the next page loads right away if the end is still in view
+		observer.unobserve(moreEl);
+		observer.observe(moreEl);
+	}
+	loading = false;
+}
+
+// fetch the next page whenever the end of the gallery scrolls into view
+let observer = new IntersectionObserver(entries => {
+	if (entries.some(entry => entry.isIntersecting)) {
+		loadMore();
+	}
+});
+observer.observe(moreEl);
@@ -0,0 +1,147 @@
+# © 2020 io mintz <io@mintz.cc>
+
+"""A minimal streaming tar writer.
+
+Only regular files are supported. The output is byte for byte what the tarfile_stream module this replaced wrote
+in its default (pax) format: plain ustar headers, plus a pax extended header for any member whose name
+isn't ASCII or doesn't fit in the ustar name field, or whose mtime is a float. It differs from recent versions of the
+standard library's tarfile module, which leave devmajor and devminor empty rather than writing zeroes.
+Names must be valid Unicode (no lone surrogates).
+
+gzip_stream compresses an archive (or anything else) as it's streamed, for .tar.gz downloads.
+"""
+
+import struct
+import zlib
+from typing import Iterable, Iterator, Union
+
+BLOCKSIZE = 512
+# the archive is padded with zero blocks to a multiple of this, like tar -b20
+RECORDSIZE = BLOCKSIZE * 20
+
+NAME_LENGTH = 100
+REGTYPE = b'0'
+XHDTYPE = b'x'
+POSIX_MAGIC = b'ustar\x0000'
+PAX_HEADER_NAME = '././@PaxHeader'
+DEFAULT_MODE = 0o644
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+class TarWriter:
+	"""Yields the pieces of a tar archive as its members are added. Nothing is copied except into headers."""
+	def __init__(self):
+		self.offset = 0
+
+	def addfile(self, name: str, mtime: Union[int, float], data: BytesLike) -> Iterator[BytesLike]:
+		"""Yield the header, contents and padding of a member."""
+		data = memoryview(data).cast('B')
+		header = member_header(name, len(data), mtime)
+		yield header
+		yield data
+
+		padding = padding_length(len(data))
+		if padding:
+			yield bytes(padding)
+
+		self.offset += len(header) + len(data) + padding
+
+	def footer(self) -> Iterator[bytes]:
+		"""Yield the end of archive marker and the padding to the end of the record."""
+		# two zero blocks, then zero blocks up to the end of the record
+		end = 2 * BLOCKSIZE
+		end += -(self.offset + end) % RECORDSIZE
+		self.offset += end
+		yield bytes(end)
+
+def padding_length(size):
+	return -size % BLOCKSIZE
+
+def member_header(name: str, size: int, mtime: Union[int, float]) -> bytes:
+	"""Return the header of a regular file member, preceded by a pax extended header if necessary."""
+	# same order as tarfile, so that the output is identical
+	pax_headers = {}
+	if not name.isascii() or len(name) > NAME_LENGTH:
+		pax_headers['path'] = name
+	if not 0 <= size < 8 ** 11:
+		pax_headers['size'] = str(size)
+		size = 0
+	if isinstance(mtime, float) or not 0 <= mtime < 8 ** 11:
+		pax_headers['mtime'] = str(mtime)
+		mtime = 0
+
+	header = ustar_header(name, size=size, mtime=mtime, type=REGTYPE, mode=DEFAULT_MODE)
+	if not pax_headers:
+		return header
+
+	return pax_header(pax_headers) + header
+
+def pax_header(pax_headers) -> bytes:
+	records = b''.join(pax_record(keyword.encode(), value.encode()) for keyword, value in pax_headers.items())
+	header = ustar_header(PAX_HEADER_NAME, size=len(records), mtime=0, type=XHDTYPE, mode=0)
+	return header + records + bytes(padding_length(len(records)))
+
+def pax_record(keyword: bytes, value: bytes) -> bytes:
+	# each record starts with its own length, including the digits of the length itself
+	length = len(keyword) + len(value) + len(b' =\n')
+	total = prev = 0
+	while True:
+		total = length + len(str(prev))
+		if total == prev:
+			break
+		prev = total
+	return b'%d %s=%s\n' % (total, keyword, value)
+
+def ustar_header(name, *, size, mtime, type, mode) -> bytes:  # pylint: disable=redefined-builtin
+	header = bytearray(b''.join([
+		name.encode('ascii', 'replace')[:NAME_LENGTH].ljust(NAME_LENGTH, b'\0'),
+		octal(mode, 8),
+		octal(0, 8),  # uid
+		octal(0, 8),  # gid
+		octal(size, 12),
+		octal(mtime, 12),
+		b' ' * 8,  # checksum, which is computed as if it were spaces
+		type,
+		bytes(100),  # linkname
+		POSIX_MAGIC,
+		bytes(32),  # uname
+		bytes(32),  # gname
+		octal(0, 8),  # devmajor
+		octal(0, 8),  # devminor
+		bytes(155),  # prefix
+	]).ljust(BLOCKSIZE, b'\0'))
+	header[148:155] = b'%06o\0' % sum(header)
+	return bytes(header)
+
+def octal(n, digits):
+	return b'%0*o\0' % (digits - 1, int(n))
+
+GZIP_LEVEL = 6
+
+def gzip_stream(
+	chunks: Iterable[BytesLike], *, filename: str, mtime: Union[int, float], level=GZIP_LEVEL,
+) -> Iterator[bytes]:
+	"""Yield chunks compressed as a gzip file whose original name and modification time are those given.
+	Using the archive's own mtime rather than the current time means the same archive always compresses
+	to the same bytes.
+	"""
+	compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, 0)
+	crc = zlib.crc32(b'')
+	size = 0
+	# magic, deflate, FNAME flag, mtime, no extra flags, unknown OS, then FNAME
+	yield b''.join([
+		b'\037\213\010\010',
+		struct.pack('<L', int(mtime)),
+		b'\000\377',
+		filename.encode('iso-8859-1', 'replace'),
+		b'\0',
+	])
+
+	for chunk in chunks:
+		crc = zlib.crc32(chunk, crc)
+		size += len(chunk)
+		compressed = compressor.compress(chunk)
+		if compressed:
+			yield compressed
+
+	yield compressor.flush() + struct.pack('<LL', crc, size & 0xFFFFFFFF)
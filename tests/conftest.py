@@ -0,0 +1,18 @@
+# © 2020 io mintz <io@mintz.cc>
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the app reads config.toml, queries.sql and its data files relative to the working directory
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+
+def require_app():
+	"""Skip the calling test module unless the app's dependencies and config.toml are available."""
+	for module in 'wand.image', 'flask', 'syncpg', 'nintendo':
+		pytest.importorskip(module)
+	if not os.path.exists('config.toml'):
+		pytest.skip('config.toml is required', allow_module_level=True)
@@ -0,0 +1,11 @@
+# © 2020 io mintz <io@mintz.cc>
+
+import stat
+
+import disk_cache
+
+def test_entries_are_readable_by_others(tmp_path):
+	disk_cache.write(tmp_path, 'entry', b'data')
+	mode = stat.S_IMODE((tmp_path / 'entry').stat().st_mode)
+	# not the 0600 that mkstemp gives it
+	assert mode == disk_cache.ENTRY_MODE
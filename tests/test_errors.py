@@ -0,0 +1,11 @@
+# © 2020 io mintz <io@mintz.cc>
+
+from http import HTTPStatus
+
+from acnh.errors import InvalidLayerIndexError
+
+def test_invalid_layer_index_to_dict():
+	d = InvalidLayerIndexError(num_layers=2).to_dict()
+	assert d['error_code'] == 206
+	assert d['http_status'] == HTTPStatus.NOT_FOUND
+	assert d['num_layers'] == 2
@@ -0,0 +1,25 @@
+# © 2020 io mintz <io@mintz.cc>
+
+from http import HTTPStatus
+
+from conftest import require_app
+
+require_app()
+
+# pylint: disable=wrong-import-position
+import acnh.designs.db as designs_db
+from app import app
+
+def test_image_layer_out_of_range(monkeypatch):
+	layers = [b'layer 0', b'layer 1']
+	monkeypatch.setattr(designs_db, 'image_previews', lambda image_id: {'net_image': b'', 'layers': layers})
+
+	client = app.test_client()
+	response = client.get(f'/api/v0/image/1/layers/{len(layers)}.png', headers={'User-Agent': 'test'})
+	assert response.status_code == HTTPStatus.NOT_FOUND
+	assert response.get_json()['error_code'] == 206
+	assert response.get_json()['num_layers'] == len(layers)
+
+	response = client.get('/api/v0/image/1/layers/1.png', headers={'User-Agent': 'test'})
+	assert response.status_code == HTTPStatus.OK
+	assert response.data == layers[1]
@@ -0,0 +1,31 @@
+# © 2020 io mintz <io@mintz.cc>
+
+import json
+import os
+import subprocess
+import sys
+
+import metrics
+
+def exited_pid():
+	process = subprocess.Popen([sys.executable, '-c', ''])
+	process.wait()
+	return process.pid
+
+def test_collect_merges_exited_processes(tmp_path, monkeypatch):
+	monkeypatch.setattr(metrics, 'metrics_dir', lambda: tmp_path)
+	monkeypatch.setattr(metrics, '_process_values', {})
+	values = {'acplaza_test_total': {'[]': [3]}}
+	for _ in range(2):
+		(tmp_path / f'{exited_pid()}-00000000.json').write_text(json.dumps(values))
+
+	assert metrics.collect()['acplaza_test_total']['[]'] == [6]
+	# this process may have written its own file too
+	own_file = f'{os.getpid()}-'
+	assert all(path.name.startswith(own_file) for path in tmp_path.glob('*-*.json'))
+
+	(tmp_path / f'{exited_pid()}-00000000.json').write_text(json.dumps(values))
+	# counters never go backwards
+	assert metrics.collect()['acplaza_test_total']['[]'] == [9]
+	assert metrics.collect()['acplaza_test_total']['[]'] == [9]
+	assert all(path.name.startswith(own_file) for path in tmp_path.glob('*-*.json'))
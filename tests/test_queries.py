@@ -0,0 +1,60 @@
+# © 2020 io mintz <io@mintz.cc>
+
+"""Run queries against a scratch copy of schema.sql in the database configured in config.toml."""
+
+import pytest
+
+from conftest import require_app
+
+require_app()
+
+# pylint: disable=wrong-import-position
+import syncpg
+
+from utils import config, queries
+
+class Rollback(Exception):
+	pass
+
+@pytest.fixture
+def db():
+	try:
+		connection = syncpg.connect(**config['postgres-db'])
+	except OSError as exc:
+		pytest.skip(f'no database to test against: {exc}')
+
+	try:
+		with connection.transaction():
+			connection.execute('CREATE SCHEMA acplaza_test; SET LOCAL search_path TO acplaza_test')
+			with open('schema.sql') as f:
+				connection.execute(f.read())
+			yield connection
+			raise Rollback
+	except Rollback:
+		pass
+	finally:
+		connection.close()
+
+def create_image(db, **kwargs):
+	author_id = db.fetchval(str(queries.authorize_user()), b'', 'test')
+	image_id = db.fetchval(
+		str(queries.create_image()), author_id, 'Anonymous', 'test', 64, 64, 'tile', 99, [b'layer'],
+	)
+	for position, design_id in kwargs.get('designs', {}).items():
+		db.execute(str(queries.create_design()), image_id, design_id, position, False, None, 1)
+	return image_id
+
+@pytest.mark.parametrize('designs', [{}, {1: 10, 2: 11}])
+def test_image_with_designs_shard(db, designs):
+	image_id = create_image(db, designs=designs)
+	db.execute(str(queries.set_image_shard()), image_id, 1)
+
+	rows = db.fetch(str(queries.image_with_designs(layers=False)), image_id)
+	assert len(rows) == max(len(designs), 1)
+	# the image's shard is kept even once its designs are gone
+	assert all(row['shard'] == 1 for row in rows)
+
+def test_image_shard_falls_back_to_designs(db):
+	image_id = create_image(db, designs={1: 10})
+	assert db.fetchval(str(queries.image_shard()), image_id) == 1
+	assert db.fetchval(str(queries.set_image_shard()), image_id, 2) == 1
@@ -0,0 +1,96 @@
+# © 2020 io mintz <io@mintz.cc>
+
+from conftest import require_app
+
+require_app()
+
+# pylint: disable=wrong-import-position
+import acnh.designs.db as designs_db
+
+class FakeConnection:
+	def __init__(self, image_rows, payload_rows):
+		self.results = [image_rows, payload_rows]
+
+	def fetch(self, *_):
+		return self.results.pop(0)
+
+def image_row(**kwargs):
+	return {
+		'image_id': 1,
+		'author_id': 1,
+		'author_name': 'Anonymous',
+		'image_name': 'test',
+		'created_at': None,
+		'type_code': 99,
+		'design_id': None,
+		'position': None,
+		'shard': None,
+		**kwargs,
+	}
+
+def test_refresh_scaled_image(monkeypatch):
+	# stored at 64×64, but scaled to a single design, which was evicted
+	rows = [image_row(width=64, height=64, mode='scale', pro=False, designs_required=1)]
+	connection = FakeConnection(rows, [])
+	monkeypatch.setattr(designs_db, 'pg', lambda: connection)
+	monkeypatch.setattr(designs_db, 'image_layers', lambda image_id: [b''])
+	monkeypatch.setattr(designs_db, 'rebuild_designs', lambda image_info: {1: 'design'})
+	monkeypatch.setattr(designs_db.page_cache, 'forget_image', lambda image_id: None)
+
+	encoded_positions = []
+
+	def encode_payload(image_id, position, design):
+		encoded_positions.append(position)
+		return False, {}
+
+	def upload_designs(image_id, payloads, count, *, pro):
+		payloads = list(payloads)
+		assert count == len(payloads)
+		for _, was_quantized, _ in payloads:
+			yield was_quantized, 1
+
+	monkeypatch.setattr(designs_db, 'encode_payload', encode_payload)
+	monkeypatch.setattr(designs_db, 'upload_designs', upload_designs)
+
+	assert list(designs_db.refresh_image(1)) == [(False, 1)]
+	assert encoded_positions == [1]
+
+def test_refresh_quantize_whole(monkeypatch):
+	# two of the four tiles were uploaded before the first attempt of a quantize_whole job died
+	rows = [
+		image_row(
+			width=64, height=64, mode='tile', pro=False, designs_required=4, design_id=10 + position, position=position,
+		)
+		for position in (1, 2)
+	]
+	connection = FakeConnection(rows, [])
+	monkeypatch.setattr(designs_db, 'pg', lambda: connection)
+	monkeypatch.setattr(designs_db, 'image_layers', lambda image_id: [b''])
+	monkeypatch.setattr(designs_db.page_cache, 'forget_image', lambda image_id: None)
+
+	class Design:
+		def __init__(self, position):
+			self.layer_images = {'0': position}
+			self.design_name = f'test {position}'
+			self.island_name = self.author_name = None
+
+	monkeypatch.setattr(designs_db, 'rebuild_designs', lambda image_info: {p: Design(p) for p in range(1, 5)})
+	quantized = []
+
+	def quantize_tiles(tiles):
+		quantized.append(tiles)
+		return [(b'', (32, 32), True) for _ in tiles]
+
+	monkeypatch.setattr(designs_db.encode, 'quantize_tiles', quantize_tiles)
+	monkeypatch.setattr(designs_db.encode, 'encode_basic_pixels', lambda *args, quantized, **kwargs: (quantized, {}))
+	monkeypatch.setattr(designs_db, 'save_payload', lambda *args: None)
+
+	def upload_designs(image_id, payloads, count, *, pro):
+		for position, was_quantized, _ in payloads:
+			yield was_quantized, position
+
+	monkeypatch.setattr(designs_db, 'upload_designs', upload_designs)
+
+	assert list(designs_db.refresh_image(1, quantize_whole=True)) == [(True, 4), (True, 3)]
+	# against a palette shared by every tile, not just the missing ones
+	assert quantized == [[1, 2, 3, 4]]
@@ -4,23 +4,30 @@ import asyncio
 import base64
 import contextlib
 import datetime as dt
-import json
+import functools
+import hashlib
 import secrets
+import shutil
 import subprocess
 import os
 import sys
+import tempfile
+import time
 import urllib.parse
+from http import HTTPStatus
 
 import flask.json
 import jinja2
+import msgpack
 import wand.image
 import toml
 import asyncpg
 import syncpg
-from flask import current_app, g, request, session, url_for
+from flask import abort, current_app, g, jsonify, request, session, url_for
 from flask_wtf.csrf import CSRFProtect
 from flask_limiter import Limiter
 
+import metrics
 from acnh.errors import ACNHError, MissingUserAgentStringError, IncorrectAuthorizationError
 
 # config comes first to resolve circular imports
@@ -45,11 +52,27 @@ def limiter_key():
 
 limiter = Limiter(key_func=limiter_key)
 
-if os.name != 'nt':
+@functools.lru_cache(maxsize=None)
+def python_executable():
+	"""Return the Python interpreter to run subprocesses with."""
+	if os.name == 'nt':
+		return sys.executable
 	# this is pretty gay but it's necessary to make uwsgi work since sys.executable is uwsgi otherwise
-	sys.executable = subprocess.check_output('which python3', shell=True, encoding='utf-8').rstrip()
+	return shutil.which('python3') or sys.executable
+
+# uploaded files are kept in memory up to this many bytes each, and written to a temporary file past that
+DEFAULT_UPLOAD_SPOOL_SIZE = 512 * 1024
+DEFAULT_MAX_REQUEST_SIZE = 32 * 1024 ** 2
+
+class Request(flask.Request):
+	def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+		# werkzeug writes the whole file to disk if the request is over 500 KiB, even if the file itself is tiny
+		return tempfile.SpooledTemporaryFile(max_size=config.get('upload-spool-size', DEFAULT_UPLOAD_SPOOL_SIZE))
 
 def init_app(app):
+	app.request_class = Request
+	# bigger requests are rejected with 413 Request Entity Too Large before they're read
+	app.config['MAX_CONTENT_LENGTH'] = config.get('max-request-size', DEFAULT_MAX_REQUEST_SIZE)
 	csrf = CSRFProtect(app)
 	import views.api  # resolve circular import
 	csrf.exempt(views.api.bp)
@@ -58,17 +81,60 @@ def init_app(app):
 	app.config['SESSION_COOKIE_SAMESITE'] = 'Strict'
 	app.json_encoder = CustomJSONEncoder
 	app.teardown_appcontext(close_pgconn)
+	app.before_request(note_request_start)
 	app.before_request(process_authorization)
 	app.errorhandler(ACNHError)(handle_acnh_exception)
 	limiter.init_app(app)
 	token_exempt(app.send_static_file)
 
+QUERY_SECONDS = metrics.histogram(
+	'acplaza_query_seconds', 'Time taken by database queries, by the macro in queries.sql they came from.',
+	labels=['query'],
+)
+
+class Query(str):
+	"""SQL rendered from a macro in queries.sql, which remembers the name of the macro."""
+	name: str
+
+class Queries:
+	"""Renders the macros of a jinja template module as Query objects."""
+	def __init__(self, module):
+		self.module = module
+
+	def __getattr__(self, name):
+		macro = getattr(self.module, name)
+
+		def render(*args, **kwargs):
+			query = Query(macro(*args, **kwargs))
+			query.name = name
+			return query
+
+		return render
+
+class TimedConnection:
+	"""Wraps a syncpg connection, timing each query that it runs."""
+	TIMED_METHODS = frozenset({'execute', 'executemany', 'fetch', 'fetchrow', 'fetchval', 'fetchvals'})
+
+	def __init__(self, connection):
+		self.connection = connection
+
+	def __getattr__(self, name):
+		attr = getattr(self.connection, name)
+		if name not in self.TIMED_METHODS:
+			return attr
+
+		def timed(query, *args, **kwargs):
+			with QUERY_SECONDS.time(query=getattr(query, 'name', 'other')):
+				return attr(str(query), *args, **kwargs)
+
+		return timed
+
 def pg():
 	with contextlib.suppress(AttributeError):
 		return g.pg
 
 	asyncio.set_event_loop(asyncio.new_event_loop())
-	pg = syncpg.connect(**config['postgres-db'])
+	pg = TimedConnection(syncpg.connect(**config['postgres-db']))
 	g.pg = pg
 	return pg
 
@@ -134,14 +200,21 @@ def parse_token(token):
 	secret += b'=' * (-len(secret) % 4)
 	return int(id), base64.urlsafe_b64decode(secret)
 
+def require_operator_token(token):
+	"""Abort with 404 unless the request has the header "Authorization: Bearer <token>".
+	For endpoints which are only meant for whoever runs the site, and so should look like they don't exist to anyone else.
+	"""
+	if not token or not secrets.compare_digest(request.headers.get('Authorization', ''), 'Bearer ' + token):
+		abort(HTTPStatus.NOT_FOUND)
+
 def close_pgconn(_):
 	with contextlib.suppress(AttributeError):
 		g.pg.close()
 
-queries = jinja2.Environment(
+queries = Queries(jinja2.Environment(
 	loader=jinja2.FileSystemLoader('.'),
 	line_statement_prefix='-- :',
-).get_template('queries.sql').module
+).get_template('queries.sql').module)
 
 class CustomJSONEncoder(flask.json.JSONEncoder):
 	def __init__(self, **kwargs):
@@ -157,11 +230,42 @@ class CustomJSONEncoder(flask.json.JSONEncoder):
 			return dict(o)
 		return super().default(o)
 
+MSGPACK_MIMETYPES = ['application/x-msgpack', 'application/msgpack']
+# the formats API responses can be sent in, in order of preference when the client doesn't mind
+API_MIMETYPES = ['application/json', *MSGPACK_MIMETYPES]
+
+def msgpack_default(o):
+	"""Unlike JSON, msgpack can send bytes as they are, and has its own timestamp type."""
+	if isinstance(o, dt.datetime):
+		return msgpack.Timestamp.from_datetime(o.replace(tzinfo=dt.timezone.utc))
+	if isinstance(o, asyncpg.Record):
+		return dict(o)
+	raise TypeError(f'Object of type {type(o).__name__} is not msgpack serializable')
+
+def wants_msgpack():
+	return request.accept_mimetypes.best_match(API_MIMETYPES) in MSGPACK_MIMETYPES
+
+def serialize(rv, status=HTTPStatus.OK):
+	"""Return a response containing rv as msgpack if the client prefers that (going by the Accept header),
+	and as JSON otherwise.
+	"""
+	if wants_msgpack():
+		response = current_app.response_class(msgpack.packb(rv, default=msgpack_default), mimetype=MSGPACK_MIMETYPES[0])
+	else:
+		response = jsonify(rv)
+	response.status_code = status
+	response.vary.add('Accept')
+	return response
+
+XBRZ_SECONDS = metrics.histogram('acplaza_xbrz_seconds', 'Time taken to scale an image with xBRZ.')
+PNG_ENCODE_SECONDS = metrics.histogram('acplaza_png_encode_seconds', 'Time taken to encode an image as PNG.')
+
+@XBRZ_SECONDS.timed
 def xbrz_scale_wand_in_subprocess(img: wand.image.Image, factor):
 	data = bytearray(img.export_pixels(channel_map='RGBA', storage='char'))
 
 	p = subprocess.Popen(
-		[sys.executable, '-m', 'xbrz', *map(str, (factor, *img.size))],
+		[python_executable(), '-m', 'xbrz', *map(str, (factor, *img.size))],
 		stdin=subprocess.PIPE,
 		stdout=subprocess.PIPE,
 		stderr=subprocess.PIPE,
@@ -174,24 +278,66 @@ def xbrz_scale_wand_in_subprocess(img: wand.image.Image, factor):
 	scaled.import_pixels(channel_map='RGBA', storage='char', data=stdout)
 	return scaled
 
+def layer_png(pixels: bytes, size, scale_factor=1) -> bytes:
+	"""Convert raw RGBA pixels to a PNG, scaling them up with xBRZ first unless scale_factor is 1.
+	The arguments and return value can be pickled, so this can be run in a process pool.
+	"""
+	width, height = size
+	with wand.image.Image(width=width, height=height) as image:
+		image.import_pixels(channel_map='RGBA', data=pixels)
+		if scale_factor == 1:
+			return make_png(image)
+
+		with xbrz_scale_wand_in_subprocess(image, scale_factor) as scaled:
+			return make_png(scaled)
+
+@PNG_ENCODE_SECONDS.timed
+def make_png(img: wand.image.Image) -> bytes:
+	return img.make_blob('png')
+
 def image_to_base64_url(img: wand.image.Image):
-	return (b'data:image/png;base64,' + base64.b64encode(img.make_blob('png'))).decode()
+	return png_to_base64_url(make_png(img))
+
+def png_to_base64_url(png: bytes):
+	return (b'data:image/png;base64,' + base64.b64encode(png)).decode()
+
+# PNGs up to this many bytes are inlined into pages, since a separate request for them would cost more than it saves
+INLINE_PNG_LIMIT = 1024
+
+def png_url(png: bytes, url: str):
+	"""Return a URL for png, which is also served at url. Small PNGs get a data URL.
+	Otherwise a hash of the PNG is appended to url so that caches can keep it for as long as they like.
+	"""
+	if len(png) <= INLINE_PNG_LIMIT:
+		return png_to_base64_url(png)
+	return f'{url}?v={hashlib.sha256(png).hexdigest()[:16]}'
+
+# for images which never change, such as design layers and image previews
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
 
 def handle_acnh_exception(ex):
-	"""Return JSON instead of HTML for ACNH errors"""
+	"""Return JSON (or msgpack) instead of HTML for ACNH errors"""
 	d = ex.to_dict()
-	response = current_app.response_class()
-	response.status_code = d['http_status']
-	response.data = json.dumps(d)
-	response.content_type = 'application/json'
-	return response
+	return serialize(d, d['http_status'])
+
+FIRST_CHUNK_SECONDS = metrics.histogram(
+	'acplaza_first_chunk_seconds', 'Time from the start of a request to the first chunk of its streamed response.',
+	labels=['response'],
+)
+
+def note_request_start():
+	request.started_at = time.perf_counter()
+
+def time_to_first_chunk(chunks, name):
+	"""Yield chunks, a streamed response body, observing how long it took to start sending it."""
+	return FIRST_CHUNK_SECONDS.time_to_first_chunk(chunks, start=request.started_at, response=name)
 
 def stream_template(template_name, **context):
 	current_app.update_template_context(context)
 	t = current_app.jinja_env.get_template(template_name)
 	rv = t.stream(context)
 	rv.disable_buffering()
-	return current_app.response_class(rv)
+	return current_app.response_class(time_to_first_chunk(rv, template_name))
 
 def is_safe_url(target, *, _allowed_schemes=frozenset({'http', 'https'})):
 	ref_url = urllib.parse.urlparse(request.host_url)
@@ -1,38 +1,52 @@
+import collections
 import contextlib
 import datetime as dt
-import io
 import json
+import math
+import time
 import traceback
 import urllib.parse
+from http import HTTPStatus
+from typing import Optional, Tuple
 
 import flask.json
 import wand.image
-from flask import Blueprint, jsonify, current_app, request, stream_with_context
+from flask import Blueprint, current_app, request, send_file, stream_with_context
 from werkzeug.exceptions import HTTPException
 
 import acnh.dodo as dodo
 import acnh.designs.api as designs_api
 import acnh.designs.render as designs_render
 import acnh.designs.db as designs_db
+import archive_cache
 import utils
-import tarfile_stream
+import tar_stream
+import zip_stream
 from acnh.errors import (
 	ACNHError,
 	InvalidDesignCodeError,
 	MissingLayerError,
 	InvalidScaleFactorError,
+	InvalidArchiveFormatError,
 	CannotScaleThumbnailError,
 	InvalidImageError,
+	ImageTooManyPixelsError,
 	InvalidImageIdError,
+	InvalidLayerIndexError,
+	InvalidImageJobIdError,
+	ImageJobStreamTimeoutError,
 	InvalidImageArgument,
+	InvalidLayerSizeError,
 	InvalidProArgument,
 	InvalidAuthorIdError,
 	TiledImageTooBigError,
 	InvalidPaginationError,
 	InvalidPaginationLimitError,
+	InvalidPaginationOffsetError,
 )
 from acnh.designs.db import PageSpecifier, PageDirection
-from acnh.designs.encode import BasicDesign, Design
+from acnh.designs.encode import BasicDesign, Design, NET_IMAGE_SECONDS
+from acnh.designs.format import MAX_DESIGN_TILES, WIDTH, HEIGHT
 from utils import limiter
 
 def init_app(app):
@@ -43,13 +57,14 @@ bp = Blueprint('api', __name__, url_prefix='/api/v0')
 @bp.route('/host-session/<dodo_code>')
 @limiter.limit('1 per 4 seconds')
 def host_session(dodo_code):
-	return dodo.search_dodo_code(dodo_code)
+	return utils.serialize(dodo.search_dodo_code(dodo_code))
 
 @bp.route('/design/<design_code>')
 @limiter.limit('5 per second')
 def design(design_code):
 	InvalidDesignCodeError.validate(design_code)
-	return designs_api.download_design(design_code)
+	designs_db.record_design_access(design_code)
+	return utils.serialize(designs_api.download_design(design_code))
 
 def get_scale_factor():
 	scale_factor = request.args.get('scale', '1')
@@ -68,7 +83,8 @@ def maybe_scale(image):
 def design_archive(design_code):
 	InvalidDesignCodeError.validate(design_code)
 	render_internal = 'internal_layers' in request.args
-	get_scale_factor()  # do the validation now since apparently it doesn't work in the generator
+	scale_factor = get_scale_factor()  # do the validation now since apparently it doesn't work in the generator
+	archive_format = get_archive_format()
 	data = designs_api.download_design(design_code)
 	meta, body = data['mMeta'], data['mData']
 	# pylint: disable=unused-variable
@@ -82,33 +98,75 @@ def design_archive(design_code):
 		else:
 			layers = Design.from_data(data).layer_images.items()
 
-		yield from make_tar(design_name, data['updated_at'], layers)
+		yield from make_archive(
+			design_name, data['updated_at'], layers, scale_factor=scale_factor, archive_format=archive_format,
+		)
 
-	encoded_filename = urllib.parse.quote(design_name + '.tar')
 	return current_app.response_class(
-		stream_with_context(gen()),
-		mimetype='application/x-tar',
-		headers={'Content-Disposition': f"attachment; filename*=utf-8''{encoded_filename}"},
+		stream_with_context(utils.time_to_first_chunk(gen(), 'design archive')),
+		mimetype=ARCHIVE_MIMETYPES[archive_format],
+		headers=archive_headers(design_name, archive_format),
 	)
 
-def make_tar(design_name, updated_at, layers):
-	tar = tarfile_stream.open(mode='w|')
-	yield from tar.header()
+ARCHIVE_MIMETYPES = {
+	'tar': 'application/x-tar',
+	'tar.gz': 'application/gzip',
+	'zip': 'application/zip',
+}
 
-	for name, image in layers:
-		tarinfo = tarfile_stream.TarInfo(f'{design_name}/{name}.png')
-		tarinfo.mtime = updated_at
+def get_pro():
+	return BOOLEAN_ARGS[InvalidProArgument.validate(request.args.get('pro', 'false')).lower()]
 
-		image = maybe_scale(image)
-		out = io.BytesIO()
-		with image.convert('png') as c:
-			c.save(file=out)
-		tarinfo.size = out.tell()
-		out.seek(0)
+def get_archive_format():
+	return InvalidArchiveFormatError.validate(request.args.get('format', 'tar'))
 
-		yield from tar.addfile(tarinfo, out)
+def archive_headers(name, archive_format):
+	encoded_filename = urllib.parse.quote(f'{name}.{archive_format}')
+	return {'Content-Disposition': f"attachment; filename*=utf-8''{encoded_filename}"}
 
-	yield from tar.footer()
+# how many layers of one archive may be rendered at once
+DEFAULT_ARCHIVE_CONCURRENCY = 4
+
+def make_archive(design_name, updated_at, layers, *, scale_factor, archive_format):
+	"""Stream an archive of the given format containing the given (name, image) layers as PNGs."""
+	if archive_format == 'zip':
+		return make_layer_archive(zip_stream.ZipWriter(), design_name, updated_at, layers, scale_factor=scale_factor)
+
+	tar = make_layer_archive(tar_stream.TarWriter(), design_name, updated_at, layers, scale_factor=scale_factor)
+	if archive_format == 'tar.gz':
+		return tar_stream.gzip_stream(tar, filename=f'{design_name}.tar', mtime=updated_at)
+	return tar
+
+def make_layer_archive(archive, design_name, updated_at, layers, *, scale_factor):
+	"""Stream archive, a TarWriter or ZipWriter, with the given (name, image) layers added as PNGs.
+	The layers are converted (and scaled) in parallel, but they're still added to the archive in order.
+	"""
+	concurrency = utils.config.get('archive-concurrency', DEFAULT_ARCHIVE_CONCURRENCY)
+	pending = collections.deque()
+
+	def add_next():
+		name, future = pending.popleft()
+		return archive.addfile(f'{design_name}/{name}.png', updated_at, future.result())
+
+	try:
+		for name, image in layers:
+			pending.append((name, designs_db.encode_pool().submit(
+				utils.layer_png,
+				bytes(image.export_pixels(channel_map='RGBA')),
+				image.size,
+				scale_factor,
+			)))
+			if len(pending) >= concurrency:
+				yield from add_next()
+
+		while pending:
+			yield from add_next()
+	finally:
+		# the client went away
+		for _, future in pending:
+			future.cancel()
+
+	yield from archive.footer()
 
 # no rate limit as we need to render the thumbnails for all of an author's designs quickly
 @bp.route('/design/<design_code>/<layer>.png')
@@ -121,7 +179,9 @@ def design_layer(design_code, layer):
 	if layer == 'thumbnail':
 		if request.args.get('scale', '1') != '1':
 			raise CannotScaleThumbnailError
-		rendered = Design.from_data(data).net_image()
+		decoded = Design.from_data(data)
+		with NET_IMAGE_SECONDS.time():
+			rendered = decoded.net_image()
 	else:
 		try:
 			int(layer)
@@ -131,26 +191,34 @@ def design_layer(design_code, layer):
 			rendered = designs_render.render_layer(body, layer)
 
 	rendered = maybe_scale(rendered)
-	out = rendered.make_blob('png')
+	out = utils.make_png(rendered)
 
 	encoded_filename = urllib.parse.quote(f'{design_name}-{layer}.png')
 	return current_app.response_class(out, mimetype='image/png', headers={
 		'Content-Length': len(out),
-		'Content-Disposition': f"inline; filename*=utf-8''{encoded_filename}"
+		'Content-Disposition': f"inline; filename*=utf-8''{encoded_filename}",
+		# designs can't be edited, only deleted
+		'Cache-Control': utils.IMMUTABLE_CACHE_CONTROL,
 	})
 
 @bp.route('/designs/<author_id>')
 @limiter.limit('5 per 1 seconds')
 def list_designs(author_id):
 	author_id = int(InvalidAuthorIdError.validate(author_id).replace('-', ''))
-	pro = request.args.get('pro', 'false')
-	InvalidProArgument.validate(pro)
+	pro = get_pro()
+	offset = int(InvalidPaginationOffsetError.validate(request.args.get('offset', '0')))
+	limit = int(InvalidPaginationLimitError.validate(request.args.get('limit', str(designs_api.MAX_PAGE_SIZE))))
+	limit = min(limit, designs_api.MAX_PAGE_SIZE)
 
-	page = designs_api.list_designs(author_id, pro=pro)
-	del page['offset'], page['count'], page['total']
+	page = designs_api.list_designs(author_id, pro=pro, offset=offset, limit=limit)
+	del page['count']
 	page['designs'] = page.pop('headers')
-	page['creator_name'] = page['designs'][0]['design_player_name']
-	page['author_id'] = page['designs'][0]['design_player_id']
+	if page['designs']:
+		page['creator_name'] = page['designs'][0]['design_player_name']
+		page['author_id'] = page['designs'][0]['design_player_id']
+	end = offset + len(page['designs'])
+	# the offset of the next page, or None if this is the last one
+	page['next_offset'] = end if end < page['total'] else None
 
 	for d in page['designs']:
 		d['design_code'] = designs_api.design_code(d['id'])
@@ -160,18 +228,37 @@ def list_designs(author_id):
 		# designs cannot be updated, so why is this even here??
 		del d['updated_at']
 
-	return page
+	return utils.serialize(page)
 
 @bp.route('/images', methods=['POST'])
 @limiter.limit('1 per 15s')
 def create_image():
+	if 'job' in request.values:
+		return enqueue_image()
+
 	gen = format_created_design_results(create_image_gen())
 	# Note: this is currently the only method (other than the rendering methods) which does *not* return JSON.
 	# This is due to its iterative nature. I considered using JSON anyway, but very few libraries
 	# support iterative JSON decoding, and we don't need anything other than an array anyway.
 	return current_app.response_class(stream_with_context(gen), mimetype='text/plain')
 
-def create_image_gen():
+def enqueue_image():
+	with contextlib.closing(create_image_gen(create=_enqueue_image)) as gen:
+		rv = next(gen)
+
+	if isinstance(rv, dict):
+		return utils.serialize(rv, rv['http_status'])
+
+	image_id, job_id = rv
+	return utils.serialize({'image_id': image_id, 'job_id': job_id}, HTTPStatus.ACCEPTED)
+
+def _enqueue_image(design, **kwargs):
+	yield designs_db.enqueue_image(design, **kwargs)
+
+def create_image_gen(create=designs_db.create_image):
+	"""Parse and validate an uploaded image, then pass the resulting design to create,
+	which should return an iterable of results.
+	"""
 	try:
 		image_name = request.values['image_name']
 	except KeyError:
@@ -182,24 +269,86 @@ def create_image_gen():
 	design_type_name = request.values.get('design_type', 'basic-design')
 	try:
 		if design_type_name == 'basic-design':
-			yield from create_basic_image(image_name, author_name)
+			yield from create_basic_image(image_name, author_name, create)
 		else:
-			yield from create_pro_image(image_name, author_name, design_type_name)
+			yield from create_pro_image(image_name, author_name, design_type_name, create)
 	except ACNHError as ex:
 		yield ex.to_dict()
 
-def create_pro_image(image_name, author_name, design_type_name):
+# the most pixels an uploaded image may have, unless upload-max-pixels is set.
+# Images are checked against this before they're decoded, since decoding them is what's expensive.
+DEFAULT_MAX_UPLOAD_PIXELS = 4096 * 4096
+# Basic images which are scaled to a single design are scaled down to at most this many pixels as they're decoded,
+# since they're stored, and previewed, at their original size. It's the size of the biggest tiled image.
+MAX_SCALED_IMAGE_PIXELS = MAX_DESIGN_TILES * WIDTH * HEIGHT
+
+def sniff_upload(file) -> Tuple[bytes, str, Tuple[int, int]]:
+	"""Read an uploaded image file, returning its contents, format and size.
+	Only the header is decoded, and the image is rejected if it has too many pixels.
+	"""
+	blob = file.read()
 	try:
-		layers = {
-			filename: wand.image.Image(blob=file.read()).convert('PNG')
-			for filename, file
-			in request.files.items()
-		}
+		with wand.image.Image.ping(blob=blob) as pinged:
+			image_format, size = pinged.format, pinged.size
 	except wand.image.WandException:
-		print('In:', request.path)
+		print('In', request.path)
 		traceback.print_exc()
 		raise InvalidImageError
 
+	max_pixels = utils.config.get('upload-max-pixels', DEFAULT_MAX_UPLOAD_PIXELS)
+	if size[0] * size[1] > max_pixels:
+		raise ImageTooManyPixelsError(size[0] * size[1], max_pixels)
+	return blob, image_format, size
+
+def decode_upload(blob, image_format, *, size_hint=None) -> wand.image.Image:
+	"""Decode an uploaded image as returned by sniff_upload. If the image is about to be scaled down
+	to size_hint, a (width, height) pair, decoders which are able to (JPEG's) skip decoding it at full size.
+	"""
+	img = wand.image.Image()
+	try:
+		if size_hint is not None:
+			img.options['jpeg:size'] = '{}x{}'.format(*size_hint)
+		img.read(blob=blob, format=image_format)
+	except wand.image.WandException:
+		img.close()
+		print('In', request.path)
+		traceback.print_exc()
+		raise InvalidImageError
+	img.format = 'png'
+	return img
+
+def fit_pixels(size, max_pixels) -> Optional[Tuple[int, int]]:
+	"""Return size scaled down to at most max_pixels pixels, keeping its aspect ratio,
+	or None if it's small enough already.
+	"""
+	width, height = size
+	if width * height <= max_pixels:
+		return None
+	ratio = math.sqrt(max_pixels / (width * height))
+	return max(1, int(width * ratio)), max(1, int(height * ratio))
+
+def fit_box(size, box) -> Tuple[int, int]:
+	"""Return roughly the size that an image of the given size is resized to by the geometry WxH, where box is (W, H).
+	This rounds down, so it's never bigger than what ImageMagick does.
+	"""
+	width, height = size
+	ratio = min(box[0] / width, box[1] / height)
+	return max(1, int(width * ratio)), max(1, int(height * ratio))
+
+def create_pro_image(image_name, author_name, design_type_name, create):
+	# an invalid design type is reported by Design() below
+	external_layers = getattr(Design.design_types.get(design_type_name), 'external_layer_names', {})
+
+	uploads = {}
+	for filename, file in request.files.items():
+		uploads[filename] = upload = sniff_upload(file)
+		layer = external_layers.get(filename)
+		# check this before decoding any of the layers
+		if layer is not None and upload[2] != layer.size:
+			raise InvalidLayerSizeError(layer.name, *layer.size)
+
+	layers = {filename: decode_upload(blob, image_format) for filename, (blob, image_format, _) in uploads.items()}
+
 	design = Design(
 		design_type_name,
 		island_name=designs_db.island_name(),
@@ -211,9 +360,9 @@ def create_pro_image(image_name, author_name, design_type_name):
 	with contextlib.ExitStack() as stack:
 		for img in layers.values():
 			stack.enter_context(img)
-		yield from designs_db.create_image(design)
+		yield from create(design)
 
-def create_basic_image(image_name, author_name):
+def create_basic_image(image_name, author_name, create):
 	width = height = None
 
 	def get_int_value(name):
@@ -234,18 +383,33 @@ def create_basic_image(image_name, author_name):
 
 	scale = 'scale' in request.values or request.values.get('mode') == 'scale'
 
+	quantize = request.values.get('quantize') or 'tile'
+	if quantize not in {'tile', 'image'}:
+		raise InvalidImageArgument('quantize')
+
 	try:
-		img = wand.image.Image(blob=request.files['0'].read()).convert('PNG')
-	except wand.image.WandException as exc:
-		print('In', request.path)
-		traceback.print_exc()
-		raise InvalidImageError
+		file = request.files['0']
 	except KeyError:
 		# pylint: disable=no-member  # external_layers is defined dynamically
 		raise MissingLayerError(BasicDesign.external_layers[0])
 
-	if width is not None and not scale:
-		img.transform(resize=f'{width}x{height}')
+	blob, image_format, size = sniff_upload(file)
+
+	# check how many tiles the image will make, and how big it'll be, before decoding it
+	resize = None
+	if scale:
+		resize = fit_pixels(size, MAX_SCALED_IMAGE_PIXELS)
+	elif width is not None and height is not None:
+		resize = width, height
+		TiledImageTooBigError.validate_size(*fit_box(size, resize))
+	elif width is None and height is None:
+		TiledImageTooBigError.validate_size(*size)
+
+	img = decode_upload(blob, image_format, size_hint=resize)
+	if resize is not None:
+		img.transform(resize='{}x{}'.format(*resize))
+	elif width is not None or height is not None:
+		img.transform(resize=f'{width or ""}x{height or ""}')
 	# do this again now because custom exception handlers don't run for generators ¯\_(ツ)_/¯
 	TiledImageTooBigError.validate(img)
 
@@ -257,7 +421,7 @@ def create_basic_image(image_name, author_name):
 	)
 
 	with img:
-		yield from designs_db.create_image(design, scale=scale)
+		yield from create(design, scale=scale, quantize_whole=quantize == 'image')
 
 def format_created_design_results(gen, *, header=True):
 	def maybe_error(row):
@@ -288,7 +452,7 @@ def images():
 		# images are meant to be anonymous, with the author identified solely by their chosen name
 		del image_info['author_id']
 		image_info['design_type'] = Design(image_info.pop('type_code')).name
-	return jsonify(rv)
+	return utils.serialize(rv)
 
 def parse_keyset_params():
 	# before='' means last
@@ -318,23 +482,74 @@ def parse_keyset_params():
 
 	return PageSpecifier(direction, reference, limit)
 
+# the fields of the image object returned by GET /image/:image-id
+IMAGE_FIELDS = frozenset({
+	'image_id',
+	'author_name',
+	'image_name',
+	'created_at',
+	'width',
+	'height',
+	'mode',
+	'layers',
+	'pro',
+	'designs_required',
+	'design_type',
+})
+
+BOOLEAN_ARGS = {'1': True, 'true': True, 't': True, '0': False, 'false': False, 'f': False}
+
 @bp.route('/image/<image_id>')
 def image(image_id):
-	rv = designs_db.image(int(InvalidImageIdError.validate(image_id)))
+	image_id = int(InvalidImageIdError.validate(image_id))
+	fields = get_image_fields()
+	include_layers = BOOLEAN_ARGS.get(request.args.get('include_layers', 'true').lower())
+	if include_layers is None:
+		raise InvalidImageArgument('include_layers')
+
+	# layers are by far the biggest part of an image, so don't even fetch them unless they're wanted
+	rv = designs_db.image(image_id, layers=include_layers and 'layers' in fields)
+	designs_db.record_image_access(image_id)
+	del rv['shard']
 	# images are meant to be anonymous, with the author identified solely by their chosen name
 	del rv['image']['author_id']
 	rv['image']['design_type'] = Design(rv['image'].pop('type_code')).name
-	return rv
+	rv['image'] = {field: value for field, value in rv['image'].items() if field in fields}
+	return utils.serialize(rv)
+
+def get_image_fields():
+	fields = request.args.get('fields')
+	if fields is None:
+		return IMAGE_FIELDS
+
+	fields = set(fields.split(','))
+	if not fields <= IMAGE_FIELDS:
+		raise InvalidImageArgument('fields')
+	return fields
 
 @bp.route('/image/<image_id>.tar')
 @limiter.limit('2 per 10 seconds')
 def image_archive(image_id):
 	image_id = int(InvalidImageIdError.validate(image_id))
-	image_info = designs_db.image(image_id)['image']
+	image_info = designs_db.image(image_id, layers=False)['image']
 	render_internal = 'internal_layers' in request.args
+	scale_factor = get_scale_factor()
+	archive_format = get_archive_format()
+	mimetype = ARCHIVE_MIMETYPES[archive_format]
+	headers = archive_headers(image_info['image_name'], archive_format)
+
+	cache_name = archive_cache.filename(
+		image_id, scale_factor=scale_factor, internal_layers=render_internal, archive_format=archive_format,
+	)
+	if archive_cache.enabled():
+		path = archive_cache.lookup(cache_name)
+		response = None if path is None else send_cached_archive(path, mimetype, headers)
+		if response is not None:
+			return response
+
 	layers = {}
 	cls = Design(image_info['type_code'])
-	for layer, image_blob in zip(cls.external_layers, image_info['layers']):
+	for layer, image_blob in zip(cls.external_layers, designs_db.image_layers(image_id)):
 		if image_info['pro']:
 			layers[layer.name] = img = layer.as_wand()
 		else:
@@ -349,16 +564,63 @@ def image_archive(image_id):
 	else:
 		requested_layers = layers.items()
 
-	gen = make_tar(image_info['image_name'], image_info['created_at'].timestamp(), requested_layers)
-	encoded_filename = urllib.parse.quote(image_info['image_name'] + '.tar')
+	gen = make_archive(
+		image_info['image_name'],
+		image_info['created_at'].timestamp(),
+		requested_layers,
+		scale_factor=scale_factor,
+		archive_format=archive_format,
+	)
+	if archive_cache.enabled():
+		gen = archive_cache.write_through(cache_name, gen)
+
 	return current_app.response_class(
-		stream_with_context(gen),
-		mimetype='application/x-tar',
-		headers={
-			'Content-Disposition': f"attachment; filename*=utf-8''{encoded_filename}",
-		},
+		stream_with_context(utils.time_to_first_chunk(gen, 'image archive')),
+		mimetype=mimetype,
+		headers=headers,
 	)
 
+def send_cached_archive(path, mimetype, headers):
+	"""Serve an archive from the cache, or return None if it was evicted in the meantime."""
+	accel_redirect = utils.config.get('archive-cache-accel-redirect')
+	if accel_redirect:
+		# let the reverse proxy serve the file (including any Range requests) without tying up a worker
+		return current_app.response_class(
+			mimetype=mimetype,
+			headers={**headers, 'X-Accel-Redirect': accel_redirect + path.name},
+		)
+
+	try:
+		# conditional=True handles Range requests
+		response = send_file(str(path.resolve()), mimetype=mimetype, conditional=True)
+	except FileNotFoundError:
+		return None
+
+	response.headers.update(headers)
+	return response
+
+@bp.route('/image/<image_id>/thumbnail.png')
+@utils.token_exempt
+def image_thumbnail(image_id):
+	image_id = int(InvalidImageIdError.validate(image_id))
+	return preview_response(designs_db.image_previews(image_id)['net_image'])
+
+@bp.route('/image/<image_id>/layers/<int:index>.png')
+@utils.token_exempt
+def image_layer(image_id, index):
+	image_id = int(InvalidImageIdError.validate(image_id))
+	layers = designs_db.image_previews(image_id)['layers']
+	if not 0 <= index < len(layers):
+		raise InvalidLayerIndexError(num_layers=len(layers))
+	return preview_response(layers[index])
+
+def preview_response(png):
+	return current_app.response_class(png, mimetype='image/png', headers={
+		'Content-Length': len(png),
+		# images never change after they're created
+		'Cache-Control': utils.IMMUTABLE_CACHE_CONTROL,
+	})
+
 @bp.route('/image/<image_id>/refresh', methods=['POST'])
 def refresh_image(image_id):
 	gen = stream_with_context(format_created_design_results(_refresh_image(image_id), header=False))
@@ -367,11 +629,56 @@ def refresh_image(image_id):
 def _refresh_image(image_id):
 	return designs_db.refresh_image(int(InvalidImageIdError.validate(image_id)))
 
+@bp.route('/image-jobs/<job_id>')
+@limiter.limit('2 per second')
+def image_job(job_id):
+	job = designs_db.image_job(int(InvalidImageJobIdError.validate(job_id)))
+	job['results'] = [
+		{'was_quantized': was_quantized, 'design_code': designs_api.design_code(design_id)}
+		for was_quantized, design_id
+		in designs_db.image_job_results(job['image_id'])
+	]
+	return utils.serialize(job)
+
+# how often to check on the progress of a job when streaming it
+IMAGE_JOB_POLL_INTERVAL = 0.5
+# how long to stream a job for at most, so that a job that never finishes doesn't hold a worker forever
+IMAGE_JOB_STREAM_TIMEOUT = 60
+
+@bp.route('/image-jobs/<job_id>/stream')
+def image_job_stream(job_id):
+	job_id = int(InvalidImageJobIdError.validate(job_id))
+	image_id = designs_db.image_job(job_id)['image_id']
+
+	def gen():
+		seen = set()
+		deadline = time.monotonic() + IMAGE_JOB_STREAM_TIMEOUT
+		while True:
+			# fetch the status first so that no results can be missed after the job finishes
+			job = designs_db.image_job(job_id)
+			for was_quantized, design_id in designs_db.image_job_results(image_id, after=seen):
+				seen.add(design_id)
+				yield was_quantized, design_id
+
+			if job['status'] == 'failed':
+				yield job['error']
+				return
+			if job['status'] == 'done':
+				return
+			if time.monotonic() >= deadline:
+				yield ImageJobStreamTimeoutError().to_dict()
+				return
+
+			time.sleep(IMAGE_JOB_POLL_INTERVAL)
+
+	gen = stream_with_context(format_created_design_results(gen(), header=False))
+	return current_app.response_class(gen, mimetype='text/plain')
+
 @bp.route('/image/<image_id>', methods=['DELETE'])
 def delete_image(image_id):
 	image_id = int(InvalidImageIdError.validate(image_id))
 	designs_db.delete_image(image_id)
-	return jsonify('OK')
+	return utils.serialize('OK')
 
 @bp.errorhandler(HTTPException)
 def handle_exception(ex):
@@ -3,8 +3,6 @@
 import datetime as dt
 from http import HTTPStatus
 
-import msgpack
-import wand.image
 from flask import (
 	abort,
 	Blueprint,
@@ -18,10 +16,11 @@ from flask import (
 )
 from werkzeug.exceptions import HTTPException
 
+import page_cache
 import utils
 from views import api
 from acnh import dodo
-from acnh.common import acnh
+from acnh.common import account, shards
 from acnh.errors import (
 	ACNHError,
 	InvalidAuthorIdError,
@@ -37,16 +36,18 @@ from utils import limiter
 
 def init_app(app):
 	app.register_blueprint(bp)
-	api_author_id = utils.config['acnh-design-creator-id']
 	# for comparisons
-	app.add_template_global(api_author_id, name='api_author_id')
-	# for display
-	app.add_template_global(designs_api.add_hyphens(str(api_author_id)), name='pretty_api_author_id')
+	app.add_template_global(
+		frozenset(account(shard)['acnh-design-creator-id'] for shard in shards()),
+		name='api_author_ids',
+	)
 	app.add_template_global(
 		"This design had to be quantized to fit the game's 16 color limit.",
 		name='quantized_message',
 	)
 	app.add_template_global(__import__('time').sleep)
+	app.add_template_global(utils.config.get('image-jobs', False), name='image_jobs')
+	app.add_template_global(page_cache.fragment)
 
 bp = Blueprint('frontend', __name__)
 
@@ -134,29 +135,39 @@ def designs_form():
 bp.route('/design/<design_code>/<layer>.png')(api.design_layer)
 bp.route('/design/<design_code>.tar')(api.design_archive)
 bp.route('/image/<image_id>.tar')(api.image_archive)
+bp.route('/image/<image_id>/thumbnail.png')(api.image_thumbnail)
+bp.route('/image/<image_id>/layers/<int:index>.png')(api.image_layer)
+
+# the scale of design layer previews, which are otherwise too small to make out
+PREVIEW_SCALE_FACTOR = 6
 
 @bp.route('/design/<design_code>')
 @limiter.limit('2 per 10 seconds')
 def design(design_code):
-	image_info = designs_db.design_image(design_code)
+	design_id = designs_api.design_id(InvalidDesignCodeError.validate(design_code))
+	response = page_cache.page(page_cache.design_key(design_id), lambda: design_page(design_id))
+	designs_db.record_design_access(design_id)
+	return response
+
+def design_page(design_id):
+	image_info = designs_db.design_image(design_id)
 	if image_info and image_info['designs_required'] == 1:
 		return redirect(url_for('.image', image_id=image_info['image_id']))
 
-	data = designs_api.download_design(design_code)
+	data = designs_api.download_design(design_id)
 	meta = data['mMeta']
 	design_name = meta['mMtDNm']
+	design_code = designs_api.design_code(design_id)
 
 	design = designs_encode.Design.from_data(data)
 
-	def gen():
-		for name, image in design.layer_images.items():
-			yield (
-				name.capitalize().replace('-', ' '),
-				utils.image_to_base64_url(utils.xbrz_scale_wand_in_subprocess(image, 6)),
-			)
+	# design codes never change, so these URLs are stable cache keys on their own
+	layers = [
+		(name.capitalize().replace('-', ' '), f'/design/{design_code}/{name}.png?scale={PREVIEW_SCALE_FACTOR}')
+		for name in design.layer_images
+	]
 
-	return utils.stream_template(
-		'design.html',
+	return page_cache.Page('design.html', dict(
 		created_at=dt.datetime.utcfromtimestamp(data['created_at']),
 		image_id=image_info and image_info['image_id'],
 		author_name=data['author_name'],
@@ -166,9 +177,13 @@ def design(design_code):
 		design_name=design_name,
 		design_type=type(design).display_name,
 		island_name=meta['mMtVNm'],
-		layers=stream_with_context(gen()),
-		preview=utils.image_to_base64_url(design.net_image()) if meta['mMtPro'] else None,
-	)
+		layers=layers,
+		preview=f'/design/{design_code}/thumbnail.png' if meta['mMtPro'] else None,
+	))
+
+# the gallery lists this many designs up front, and the rest are fetched from /api/v0/designs/:author-id as they scroll
+# into view
+GALLERY_PAGE_SIZE = 30
 
 @bp.route('/designs/<author_id>')
 @limiter.limit('5 per 25 seconds')
@@ -183,33 +198,24 @@ def pro_designs(author_id):
 def designs(author_id, *, pro):
 	author_id = int(InvalidAuthorIdError.validate(author_id).replace('-', ''))
 	pretty_author_id = designs_api.add_hyphens(str(author_id))
-	data = designs_api.list_designs(author_id, pro=pro, with_binaries=True)
+	# only the headers are needed to lay out the gallery; thumbnails are loaded by the browser as they come into view
+	data = designs_api.list_designs(author_id, pro=pro, limit=GALLERY_PAGE_SIZE)
 	if not data['total']:
 		return render_template(
 			'no_designs.html',
 			pro=pro, design_type='Pro' if pro else 'basic', author_id=pretty_author_id,
 		)
 
-	author_name = data['headers'][0]['design_player_name']
+	designs = [(header['name'], designs_api.design_code(header['id'])) for header in data['headers']]
 
-	def designs():
-		for header in data['headers']:
-			design_data = msgpack.loads(acnh().request('GET', header['body']).content)
-			designs_api.merge_headers(design_data, header)
-			design_code = designs_api.design_code(header['id'])
-			net_image = designs_encode.Design.from_data(design_data).net_image()
-			yield (
-				design_data['mMeta']['mMtDNm'],
-				design_code,
-				utils.image_to_base64_url(net_image),
-			)
-
-	return utils.stream_template(
+	return render_template(
 		'designs.html',
 		author_id=pretty_author_id,
-		author_name=author_name,
+		author_name=data['headers'][0]['design_player_name'],
 		pro=pro,
-		designs=stream_with_context(designs()),
+		designs=designs,
+		next_offset=len(designs) if len(designs) < data['total'] else None,
+		page_size=GALLERY_PAGE_SIZE,
 		design_type='Pro' if pro else 'basic',
 	)
 
@@ -247,40 +253,37 @@ def create_pro_design_form(design_type_name):
 @utils.token_exempt
 def image(image_id):
 	image_id = int(api.InvalidImageIdError.validate(image_id))
-	data = designs_db.image(image_id)
+	response = page_cache.page(page_cache.image_key(image_id), lambda: image_page(image_id))
+	designs_db.record_image_access(image_id)
+	return response
+
+def image_page(image_id):
+	data = designs_db.image(image_id, layers=False)
 	image_info = data['image']
 	designs = data['designs']
 	cls = designs_encode.Design(image_info['type_code'])
-	cls_kwargs = dict(author_name=image_info['author_name'], design_name=image_info['image_name'])
-	if image_info['pro']:
-		layers = designs_db.gather_layers(cls, image_info['layers'])
-
-		# pylint: disable=not-callable
-		design = cls(layers=layers, **cls_kwargs)
-
-		layers = stream_with_context(
-			(
-				name.capitalize().replace('-', ' '),
-				utils.image_to_base64_url(utils.xbrz_scale_wand_in_subprocess(image, 6))
-			)
-			for name, image
-			in design.layer_images.items()
-		)
-	else:
-		img = wand.image.Image(width=image_info['width'], height=image_info['height'])
-		img.import_pixels(data=image_info['layers'][0], channel_map='RGBA')
-		if image_info['designs_required'] == 1:
-			img = utils.xbrz_scale_wand_in_subprocess(img, 6)
-		# pylint: disable=not-callable
-		design = cls(**cls_kwargs, layers={'0': img})
-		layers = stream_with_context([('0', utils.image_to_base64_url(img))])
-
-	return utils.stream_template(
+	previews = designs_db.image_previews(image_id)
+	layers = [
+		(layer.display_name, utils.png_url(png, f'/image/{image_id}/layers/{i}.png'))
+		for i, (layer, png)
+		in enumerate(zip(cls.external_layers, previews['layers']))
+	]
+
+	shard = data['shard']
+	return page_cache.Page(
 		'image.html',
-		image=image_info, design=design, layers=layers, designs=designs,
-		design_type=cls.display_name,
-		# make it an iterable so that it can be streamed
-		preview=utils.image_to_base64_url(design.net_image()) if image_info['pro'] else None
+		dict(
+			image=image_info, layers=layers, designs=designs,
+			# the creator ID of the account holding this image's designs, for display
+			pretty_api_author_id=None if shard is None else designs_api.add_hyphens(
+				str(account(shard)['acnh-design-creator-id']),
+			),
+			design_type=cls.display_name,
+			preview=utils.png_url(previews['net_image'], f'/image/{image_id}/thumbnail.png') if image_info['pro'] else None,
+		),
+		fragment_context={'image': {'image_id': image_id, 'author_id': image_info['author_id']}},
+		# designs which are still being uploaded (or were evicted) will show up soon
+		cacheable=len(designs) >= image_info['designs_required'],
 	)
 
 @bp.route('/refresh-image/<image_id>')
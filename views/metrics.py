@@ -0,0 +1,18 @@
+# © 2020 io mintz <io@mintz.cc>
+
+from flask import Blueprint, current_app
+
+import metrics
+import utils
+
+def init_app(app):
+	app.register_blueprint(bp)
+
+bp = Blueprint('metrics', __name__)
+
+@bp.route('/metrics')
+@utils.token_exempt
+def metrics_():
+	# this is for the monitoring system only
+	utils.require_operator_token(utils.config.get('metrics-token'))
+	return current_app.response_class(metrics.exposition(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,30 @@
+# © 2020 io mintz <io@mintz.cc>
+
+from flask import abort, Blueprint, send_file
+
+import profiler
+import utils
+
+def init_app(app):
+	app.register_blueprint(bp)
+
+bp = Blueprint('profiler', __name__)
+
+@bp.before_request
+def check_token():
+	utils.require_operator_token(utils.config.get('profiler-token'))
+	if not profiler.enabled():
+		abort(404)
+
+@bp.route('/profiles')
+@utils.token_exempt
+def profiles():
+	return utils.serialize(profiler.index())
+
+@bp.route('/profiles/<profile_id>.prof')
+@utils.token_exempt
+def profile(profile_id):
+	path = profiler.path(profile_id)
+	if path is None:
+		abort(404)
+	return send_file(str(path.resolve()), mimetype='application/octet-stream', as_attachment=True)
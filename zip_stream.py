@@ -0,0 +1,103 @@
+# © 2020 io mintz <io@mintz.cc>
+
+"""A minimal streaming ZIP writer, with the same interface as tar_stream.TarWriter.
+
+Each member's contents are known up front, so sizes and CRCs go straight into the local headers
+and no data descriptors are needed. Members whose contents are already compressed (e.g. PNGs) are stored,
+and everything else is deflated unless that doesn't make it any smaller. ZIP64 isn't supported,
+so no archive may exceed 4 GiB.
+"""
+
+import struct
+import time
+import zlib
+from typing import Iterator, Union
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+DEFLATE_LEVEL = 6
+
+# version 2.0, which covers deflate and directories
+VERSION_NEEDED = 20
+# made by Unix (so that external_attr holds permissions), version 2.0
+VERSION_MADE_BY = 3 << 8 | 20
+# names are UTF-8
+FLAGS = 1 << 11
+EXTERNAL_ATTR = 0o100644 << 16
+
+LOCAL_HEADER = struct.Struct('<4sHHHHHLLLHH')
+CENTRAL_HEADER = struct.Struct('<4sHHHHHHLLLHHHHHLL')
+END_OF_CENTRAL_DIRECTORY = struct.Struct('<4sHHHHLLH')
+
+# formats which gain nothing from being deflated again
+COMPRESSED_SIGNATURES = (
+	b'\x89PNG\r\n\x1a\n',
+	b'\xff\xd8\xff',  # JPEG
+	b'\x1f\x8b',  # gzip
+	b'PK\x03\x04',
+)
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+class ZipWriter:
+	def __init__(self):
+		self.offset = 0
+		self.central_directory = []
+
+	def addfile(self, name: str, mtime: Union[int, float], data: BytesLike) -> Iterator[BytesLike]:
+		"""Yield the local header and (possibly compressed) contents of a member."""
+		data = memoryview(data).cast('B')
+		method, contents = compress(data)
+		encoded_name = name.encode()
+		dos_time, dos_date = dos_datetime(mtime)
+		crc = zlib.crc32(data)
+
+		header = LOCAL_HEADER.pack(
+			b'PK\x03\x04',
+			VERSION_NEEDED, FLAGS, method, dos_time, dos_date, crc, len(contents), len(data),
+			len(encoded_name), 0,
+		) + encoded_name
+		self.central_directory.append(CENTRAL_HEADER.pack(
+			b'PK\x01\x02',
+			VERSION_MADE_BY, VERSION_NEEDED, FLAGS, method, dos_time, dos_date, crc, len(contents), len(data),
+			len(encoded_name), 0, 0,  # extra field length, comment length
+			0, 0,  # starting disk, internal attributes
+			EXTERNAL_ATTR, self.offset,
+		) + encoded_name)
+
+		yield header
+		yield contents
+		self.offset += len(header) + len(contents)
+
+	def footer(self) -> Iterator[bytes]:
+		"""Yield the central directory."""
+		central_directory = b''.join(self.central_directory)
+		yield central_directory + END_OF_CENTRAL_DIRECTORY.pack(
+			b'PK\x05\x06',
+			0, 0,  # this disk, the disk the central directory starts on
+			len(self.central_directory), len(self.central_directory),
+			len(central_directory), self.offset,
+			0,  # comment length
+		)
+
+def compress(data: memoryview):
+	"""Return the compression method to use for data and the data compressed accordingly."""
+	if bytes(data[:8]).startswith(COMPRESSED_SIGNATURES):
+		return ZIP_STORED, data
+
+	compressor = zlib.compressobj(DEFLATE_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+	deflated = compressor.compress(data) + compressor.flush()
+	if len(deflated) >= len(data):
+		return ZIP_STORED, data
+	return ZIP_DEFLATED, deflated
+
+def dos_datetime(timestamp):
+	"""Convert a Unix timestamp to the MS-DOS time and date fields used by ZIP, in UTC."""
+	t = time.gmtime(timestamp)
+	# MS-DOS dates start in 1980
+	if t.tm_year < 1980:
+		return 0, 1 << 5 | 1
+	return (
+		t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2,
+		(t.tm_year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday,
+	)